@@ -1,11 +1,23 @@
 from flask import Flask, request, jsonify
-import subprocess
+from werkzeug.serving import WSGIRequestHandler
 import threading
 import logging
 import os
+import sys
+import json
+import time
+import queue
+from collections import deque
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
+import urllib3
+from selenium.common.exceptions import WebDriverException, JavascriptException, NoSuchWindowException
+from websockets.sync.server import serve as serve_websocket
+from websockets.exceptions import ConnectionClosed
+import ipc
+import devtools
+import processes
 
 app = Flask(__name__)
 
@@ -23,33 +35,488 @@ logging.basicConfig(
 )
 
 # Dictionary of programs and commands
+# focus — команда, которая выводит окно уже запущенной программы вместо повторного запуска
 programs = {
     'Google Chrome': {
         'start': '/usr/bin/google-chrome',
-        'stop': 'chrome'
+        'stop': 'chrome',
+        'focus': 'wmctrl -x -a google-chrome'
     },
     'Текстовый редактор': {
         'start': '/usr/bin/subl',
-        'stop': 'subl'
+        'stop': 'subl',
+        'focus': 'wmctrl -x -a sublime_text'
     },
     'Терминал': {
         'start': '/usr/bin/terminator',
-        'stop': 'terminator'
+        'stop': 'terminator',
+        'focus': 'wmctrl -x -a terminator'
     },
     'Steam': {
         'start': '/usr/bin/steam',
-        'stop': 'steam'
+        'stop': 'steam',
+        'focus': 'wmctrl -x -a steam'
     },
     'Dota2': {
         'start': 'steam steam://rungameid/570',
-        'stop': 'dota2'
+        'stop': 'dota2',
+        'focus': 'wmctrl -x -a dota2'
     },
     'poweroff': {
         'stop': 'poweroff'
     }
 }
 
-browser_driver = None  # Глобальная переменная для управления браузером
+music_url = 'https://music.yandex.ru'
+music_api_expression = "typeof externalAPI !== 'undefined'"
+music_api_check_script = f"return {music_api_expression};"
+# Команды музыки, пришедшие за это время (и пока браузер занят), выполняются одним вызовом
+MUSIC_COALESCE_MS = 30
+# Операции пакета передаются аргументом, а не подставляются в текст скрипта
+music_batch_script = """
+var operations = arguments[0];
+for (var i = 0; i < operations.length; i++) {
+    var name = operations[i][0], value = operations[i][1];
+    if (name === 'play') externalAPI.play(1);
+    else if (name === 'setVolume') externalAPI.setVolume(value);
+    else externalAPI[name]();
+}
+var track = externalAPI.getCurrentTrack();
+return {
+    playing: externalAPI.isPlaying(),
+    volume: externalAPI.getVolume(),
+    track: track ? track.title : null
+};
+"""
+
+# Бэкенд управления музыкой: 'selenium' — через chromedriver, 'devtools' — напрямую через
+# WebSocket удалённой отладки Chrome (один переход вместо двух, без процесса chromedriver)
+MUSIC_BACKEND = 'selenium'
+DEVTOOLS_HOST = '127.0.0.1'
+DEVTOOLS_PORT = devtools.DEFAULT_PORT
+chrome_path = '/usr/bin/google-chrome'
+devtools_profile_directory = "/home/alex/.config/google-chrome-devtools"
+
+# Прогрев: музыкальный браузер открывается в фоне при запуске (здесь или флагом --warm-music),
+# сторож периодически проверяет его и перезапускает, если Chrome упал или страница ушла
+WARM_MUSIC_BROWSER = False
+MUSIC_WATCHDOG_INTERVAL_S = 30
+
+# Браузер
+BROWSER_CALL_TIMEOUT_S = 20  # Сколько вызывающий ждёт ответа от потока браузера
+# Таймауты самого WebDriver, чтобы поток браузера не завис на одном вызове
+BROWSER_SCRIPT_TIMEOUT_S = 10
+BROWSER_PAGE_LOAD_TIMEOUT_S = 15
+# Ошибки, после которых сессия проверяется и при необходимости перезапускается. Если умер
+# или завис сам chromedriver, Selenium пробрасывает ошибки urllib3 и сокетов без обёртки
+browser_session_errors = (WebDriverException, urllib3.exceptions.HTTPError, OSError)
+# Браузер для открытия ссылок живёт между командами и закрывается после простоя,
+# если пользователь закрыл все открытые в нём вкладки
+WEB_BROWSER_IDLE_CLOSE_S = 30 * 60
+
+class BrowserActor:
+    # Единственный поток, который работает с WebDriver: сессия Selenium не потокобезопасна.
+    # Вызовы function(driver, *args) кладутся в почтовый ящик и выполняются по одному.
+    # launch: True — открыть браузер через launch(), если он не запущен (одновременные команды
+    # получают один браузер); False — не открывать; None — открыть, если его не закрыли через close().
+    # Если сессия умерла во время вызова, браузер перезапускается и вызов повторяется один раз.
+    # page_ready — страница проверена и готова к вызовам; сбрасывается при запуске, закрытии
+    # браузера и при ошибке вызова, выставляют его сами вызовы.
+    # idle_close_s — закрыть браузер, если столько секунд не было вызовов (None — не закрывать)
+    # и can_close_idle(driver) подтверждает, что браузер не нужен пользователю; иначе проверка
+    # повторяется через idle_close_s.
+    # Если запуск не удался, вызовы, поставленные в очередь до его окончания, получают ту же
+    # ошибку, а не запускают браузер ещё раз; следующие вызовы пробуют запустить заново.
+    # service_pid — PID chromedriver открытого браузера: Chrome и его процессы — его потомки
+    def __init__(self, name, launch, idle_close_s=None, can_close_idle=None):
+        self.name = name
+        self.launch = launch
+        self.idle_close_s = idle_close_s
+        self.can_close_idle = can_close_idle
+        self.driver = None
+        self.service_pid = None
+        self.closed = False
+        self.page_ready = False
+        self._launch_error = None
+        self._launch_failed_at = None
+        self._mailbox = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.launches = 0
+        self.recoveries = 0
+        self.call_ms_total = 0.0
+        self.call_ms_max = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"browser-{self.name}", daemon=True)
+                self._thread.start()
+
+    def call(self, function, *args, launch=True, timeout=BROWSER_CALL_TIMEOUT_S):
+        # Результат function или её исключение; TimeoutError, если поток браузера не ответил вовремя
+        self.start()
+        reply = {'done': threading.Event(), 'cancelled': False, 'result': None, 'error': None}
+        self._mailbox.put((function, args, launch, reply, time.perf_counter()))
+        if not reply['done'].wait(timeout):
+            # Вызов, до которого очередь ещё не дошла, выполняться не будет
+            reply['cancelled'] = True
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError(f"Браузер {self.name} не ответил за {timeout} с")
+        if reply['error'] is not None:
+            raise reply['error']
+        return reply['result']
+
+    def close(self):
+        # True, если браузер был открыт. Закрытый так браузер не поднимается вызовами с launch=None
+        return self.call(self._close, launch=False)
+
+    def _close(self, driver):
+        self.closed = True
+        self._quit()
+        return driver is not None
+
+    def _run(self):
+        while True:
+            try:
+                idle_timeout = self.idle_close_s if self.driver is not None else None
+                function, args, launch, reply, queued_at = self._mailbox.get(timeout=idle_timeout)
+            except queue.Empty:
+                if self._idle_closable():
+                    logging.info(f"Браузер {self.name} простаивал {self.idle_close_s} с, закрываем")
+                    self._quit()
+                continue
+            if reply['cancelled']:
+                continue
+            started = time.perf_counter()
+            try:
+                reply['result'] = self._invoke(function, args, launch, queued_at)
+            except Exception as e:
+                reply['error'] = e
+                self.page_ready = False
+            call_ms = (time.perf_counter() - started) * 1000
+            logging.debug(f"Браузер {self.name}: {function.__name__} за {call_ms:.1f} мс, "
+                          f"в очереди {(started - queued_at) * 1000:.1f} мс")
+            with self._lock:
+                self.calls += 1
+                self.errors += reply['error'] is not None
+                self.call_ms_total += call_ms
+                self.call_ms_max = max(self.call_ms_max, call_ms)
+            reply['done'].set()
+
+    def _invoke(self, function, args, launch, queued_at):
+        if self.driver is None and (launch or (launch is None and not self.closed)):
+            self._launch(queued_at)
+        try:
+            return function(self.driver, *args)
+        except browser_session_errors:
+            if self.driver is None or self._session_alive():
+                raise
+            logging.warning(f"Сессия браузера {self.name} потеряна")
+            self._quit()
+            if launch is False:
+                raise
+        self.recoveries += 1
+        self._launch(queued_at)
+        return function(self.driver, *args)
+
+    def _idle_closable(self):
+        if self.can_close_idle is None:
+            return True
+        try:
+            return self.can_close_idle(self.driver)
+        except Exception as e:
+            # Потерянную сессию закрываем, живую с непонятным состоянием — оставляем
+            logging.debug(f"Проверка простоя браузера {self.name}: {e}")
+            return not self._session_alive()
+
+    def _launch(self, queued_at):
+        if self._launch_error is not None and queued_at < self._launch_failed_at:
+            raise self._launch_error
+        started = time.perf_counter()
+        self.page_ready = False
+        try:
+            self.driver = self.launch()
+        except Exception as e:
+            self._launch_error, self._launch_failed_at = e, time.perf_counter()
+            logging.error(f"Не удалось запустить браузер {self.name}: {e}")
+            raise
+        self._launch_error = None
+        try:
+            self.service_pid = self.driver.service.process.pid
+        except AttributeError:
+            self.service_pid = None
+        self.closed = False
+        self.launches += 1
+        logging.info(f"Браузер {self.name} запущен за {time.perf_counter() - started:.1f} с")
+
+    def _quit(self):
+        self.page_ready = False
+        driver, self.driver = self.driver, None
+        self.service_pid = None
+        quit_driver(driver)
+
+    def _session_alive(self):
+        # Сессия без окон тоже считается потерянной, как и любая ошибка проверки
+        try:
+            return bool(self.driver.window_handles)
+        except Exception:
+            return False
+
+    def stats(self):
+        with self._lock:
+            calls = self.calls or 1
+            return {
+                'running': self.driver is not None,
+                'page_ready': self.page_ready,
+                'queue_depth': self._mailbox.qsize(),
+                'calls': self.calls,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'launches': self.launches,
+                'recoveries': self.recoveries,
+                'call_ms_avg': self.call_ms_total / calls,
+                'call_ms_max': self.call_ms_max,
+            }
+
+class BrowserBatcher:
+    # Собирает элементы, пришедшие почти одновременно, и выполняет их одним вызовом
+    # function(driver, items) в потоке браузера. Пакет закрывается, когда вызов реально
+    # начинает выполняться, поэтому пока браузер занят (например, запускается), новые
+    # элементы присоединяются к ожидающему пакету. Все участники получают один результат.
+    def __init__(self, actor, function, window_ms):
+        self.actor = actor
+        self.function = function
+        self.window_ms = window_ms
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def submit(self, item):
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = {'items': [], 'done': threading.Event(), 'result': None, 'error': None}
+            batch['items'].append(item)
+        if not leader:
+            batch['done'].wait()
+        else:
+            time.sleep(self.window_ms / 1000)
+            try:
+                batch['result'] = self.actor.call(self._run_batch, batch)
+            except Exception as e:
+                batch['error'] = e
+            finally:
+                self._close(batch)
+                batch['done'].set()
+        if batch['error'] is not None:
+            raise batch['error']
+        return batch['result']
+
+    def _close(self, batch):
+        with self._lock:
+            if self._batch is batch:
+                self._batch = None
+            return list(batch['items'])
+
+    def _run_batch(self, driver, batch):
+        return self.function(driver, self._close(batch))
+
+process_registry = processes.ProcessRegistry()
+process_table = processes.ProcessTable()
+def own_browser_pids():
+    # Chrome самого CommandExecutor: браузеры Selenium (через chromedriver) и Chrome для DevTools
+    pids = [browser.service_pid for browser in (music_browser, web_browser) if browser.service_pid is not None]
+    return pids + [entry['pid'] for entry in process_registry.running(['Chrome DevTools'])]
+
+# Уже запущенная программа не запускается повторно: имя процесса то же, что и для остановки
+running_programs = processes.RunningPrograms(
+    {program_name: info['stop'] for program_name, info in programs.items() if 'start' in info and 'stop' in info},
+    process_registry, process_table, own_browser_pids)
+
+websocket_port = 5001  # Постоянный канал команд от voise.py с подтверждениями
+
+class NoDelayRequestHandler(WSGIRequestHandler):
+    # Заголовки и тело ответа отправляются отдельными записями в сокет. Без TCP_NODELAY
+    # на keep-alive соединении voise.py ответ ждёт отложенного ACK клиента (~40 мс)
+    disable_nagle_algorithm = True
+
+# Пул выполнения команд
+COMMAND_WORKERS = 4
+COMMAND_QUEUE_SIZE = 32
+# Сколько команд одного типа может выполняться одновременно. Вызовы Selenium и так идут
+# по одному через music_browser, а одновременные команды музыки собираются в один вызов
+command_type_limits = {'music': 3, 'start': 2, 'stop': 2}
+QUEUE_FULL_MESSAGE = 'Очередь команд переполнена'
+
+class CommandPool:
+    # Фиксированное число рабочих потоков и ограниченная очередь. Рабочий поток берёт
+    # первую задачу, тип которой не упёрся в свой лимит в command_type_limits.
+    def __init__(self, workers=COMMAND_WORKERS, queue_size=COMMAND_QUEUE_SIZE, type_limits=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.type_limits = dict(command_type_limits if type_limits is None else type_limits)
+        self._pending = deque()
+        self._running = {}
+        self._cond = threading.Condition()
+        self._threads = []
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.run_ms_total = 0.0
+        self.run_ms_max = 0.0
+
+    def start(self):
+        with self._cond:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"command-worker-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def submit(self, task_type, function, *args):
+        # False — очередь заполнена, задача не принята
+        with self._cond:
+            if len(self._pending) >= self.queue_size:
+                self.rejected += 1
+                return False
+            self._pending.append((task_type, function, args, time.perf_counter()))
+            self.submitted += 1
+            self._cond.notify()
+        return True
+
+    def _take(self):
+        # Вызывается под self._cond
+        for index, task in enumerate(self._pending):
+            task_type = task[0]
+            limit = self.type_limits.get(task_type)
+            if limit is None or self._running.get(task_type, 0) < limit:
+                del self._pending[index]
+                self._running[task_type] = self._running.get(task_type, 0) + 1
+                return task
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                task = self._take()
+                while task is None:
+                    self._cond.wait()
+                    task = self._take()
+            task_type, function, args, submitted_at = task
+            started = time.perf_counter()
+            try:
+                function(*args)
+            except Exception as e:
+                logging.error(f"Ошибка в задаче пула ({task_type}): {e}", exc_info=True)
+            finished = time.perf_counter()
+            with self._cond:
+                self._running[task_type] -= 1
+                wait_ms = (started - submitted_at) * 1000
+                run_ms = (finished - started) * 1000
+                self.completed += 1
+                self.wait_ms_total += wait_ms
+                self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+                self.run_ms_total += run_ms
+                self.run_ms_max = max(self.run_ms_max, run_ms)
+                # Освободился слот типа: задача, ждавшая лимита, может стать доступной
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            completed = self.completed or 1
+            return {
+                'workers': self.workers,
+                'queue_depth': len(self._pending),
+                'queue_size': self.queue_size,
+                'running': {task_type: count for task_type, count in self._running.items() if count},
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'wait_ms_avg': self.wait_ms_total / completed,
+                'wait_ms_max': self.wait_ms_max,
+                'run_ms_avg': self.run_ms_total / completed,
+                'run_ms_max': self.run_ms_max,
+            }
+
+command_pool = CommandPool()
+
+def run_command(command_type, command_name, parameters, on_done=None):
+    started = time.perf_counter()
+    try:
+        ok, message = process_command(command_type, command_name, parameters)
+    except Exception as e:
+        logging.error(f"Ошибка при выполнении команды {command_type} {command_name}: {e}", exc_info=True)
+        ok, message = False, str(e)
+    if on_done is not None:
+        on_done(ok, message, (time.perf_counter() - started) * 1000)
+
+def submit_command(command_type, command_name, parameters, on_done=None):
+    # Общая точка входа для всех транспортов, возвращает (успех, сообщение).
+    # on_done(успех, сообщение, длительность в мс) вызывается после выполнения команды
+    if not command_type or not command_name:
+        return False, 'Missing command_type or command_name'
+    if command_type == 'ping':
+        return True, 'pong'
+
+    # Process the command asynchronously
+    if not command_pool.submit(command_type, run_command, command_type, command_name, parameters, on_done):
+        logging.error(f"{QUEUE_FULL_MESSAGE}, команда отклонена: {command_type} {command_name}")
+        return False, QUEUE_FULL_MESSAGE
+
+    return True, 'Команда выполняется'
+
+def handle_socket_command(command_type, command_name, parameters):
+    logging.info(f"Получен запрос через сокет: {command_type} {command_name} {parameters}")
+    return submit_command(command_type, command_name, parameters)
+
+def send_websocket_event(websocket, event):
+    try:
+        websocket.send(json.dumps(event, ensure_ascii=False))
+    except ConnectionClosed:
+        logging.warning(f"Соединение WebSocket закрыто, событие не отправлено: {event}")
+
+def handle_websocket(websocket):
+    # Команды идут подряд без ожидания ответа. На каждую сразу отправляется ack (или error),
+    # а после выполнения — done с результатом и длительностью
+    logging.info(f"Клиент WebSocket подключён: {websocket.remote_address}")
+    for raw_message in websocket:
+        try:
+            data = json.loads(raw_message)
+        except json.JSONDecodeError as e:
+            logging.error(f"Ошибка декодирования команды WebSocket: {e}")
+            continue
+        if not isinstance(data, dict):
+            logging.error(f"Команда WebSocket не является объектом JSON: {data}")
+            send_websocket_event(websocket, {'id': None, 'event': 'error',
+                                             'message': "Command must be a JSON object"})
+            continue
+        logging.info(f"Получен запрос через WebSocket: {data}")
+        command_id = data.get('id')
+
+        def on_done(ok, message, elapsed_ms, command_id=command_id):
+            send_websocket_event(websocket, {'id': command_id, 'event': 'done', 'ok': ok,
+                                             'message': message, 'elapsed_ms': elapsed_ms})
+
+        ok, message = submit_command(data.get('command_type'), data.get('command_name'),
+                                     data.get('parameters', {}), on_done)
+        send_websocket_event(websocket, {'id': command_id, 'event': 'ack' if ok else 'error', 'message': message})
+    logging.info("Клиент WebSocket отключён")
+
+def serve_websocket_commands():
+    # Браузер может открыть WebSocket на localhost с любой страницы и всегда передаёт Origin,
+    # поэтому принимаются только клиенты без Origin (voise.py), а не страницы в браузере
+    server = serve_websocket(handle_websocket, '127.0.0.1', websocket_port, origins=[None])
+    threading.Thread(target=server.serve_forever, name="command-websocket", daemon=True).start()
+    logging.info(f"Приём команд через WebSocket на порту {websocket_port}")
+    return server
 
 @app.route('/execute', methods=['POST'])
 def execute_command():
@@ -59,148 +526,464 @@ def execute_command():
     parameters = data.get('parameters', {})
     logging.info(f"Получен запрос: {data}")
 
-    if not command_type or not command_name:
-        return jsonify({'status': 'error', 'message': 'Missing command_type or command_name'}), 400
+    ok, message = submit_command(command_type, command_name, parameters)
+    if not ok:
+        return jsonify({'status': 'error', 'message': message}), 503 if message == QUEUE_FULL_MESSAGE else 400
+    return jsonify({'status': 'success', 'message': message}), 200
 
-    # Process the command asynchronously
-    threading.Thread(target=process_command, args=(command_type, command_name, parameters)).start()
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({'pool': command_pool.stats(), 'music_browser': music_backend.stats(),
+                    'web_browser': web_browser.stats(),
+                    'processes': process_registry.stats(),
+                    'running_programs': running_programs.stats()}), 200
+
+def is_batch_id(value):
+    # bool — подкласс int, но идентификатором команды не считается
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
 
-    return jsonify({'status': 'success', 'message': 'Команда выполняется'}), 200
+def validate_batch(commands):
+    # Возвращает (идентификаторы команд, зависимости) или текст ошибки.
+    # Идентификаторы приводятся к строкам для сравнения, в ответе остаются исходные
+    if not isinstance(commands, list) or not commands:
+        return 'commands must be a non-empty list'
+    if not all(isinstance(command, dict) for command in commands):
+        return 'Each command must be an object'
+    original_ids = [command.get('id', index) for index, command in enumerate(commands)]
+    if not all(is_batch_id(command_id) for command_id in original_ids):
+        return 'Command id must be a string or an integer'
+    ids = [str(command_id) for command_id in original_ids]
+    if len(set(ids)) != len(ids):
+        return 'Duplicate command id'
+    dependencies = {}
+    for command_id, command in zip(ids, commands):
+        if not command.get('command_type') or not command.get('command_name'):
+            return f'Missing command_type or command_name in command {command_id}'
+        depends_on = command.get('depends_on', [])
+        if not isinstance(depends_on, list) or not all(is_batch_id(dependency) for dependency in depends_on):
+            return f'depends_on of command {command_id} must be a list of command ids'
+        depends_on = [str(dependency) for dependency in depends_on]
+        unknown = [dependency for dependency in depends_on if dependency not in ids]
+        if unknown:
+            return f'Unknown dependencies of command {command_id}: {unknown}'
+        dependencies[command_id] = depends_on
+
+    # Проверка на циклы обходом в глубину
+    state = {}
+    def visit(command_id):
+        if state.get(command_id) == 'done':
+            return False
+        if state.get(command_id) == 'visiting':
+            return True
+        state[command_id] = 'visiting'
+        if any(visit(dependency) for dependency in dependencies[command_id]):
+            return True
+        state[command_id] = 'done'
+        return False
+    if any(visit(command_id) for command_id in ids):
+        return 'Dependency cycle in batch'
+    return ids, dependencies
+
+def execute_batch(commands, ids, dependencies):
+    # Команда ставится в пул, как только выполнены все её зависимости, поэтому независимые
+    # команды выполняются параллельно, а рабочие потоки не блокируются ожиданием.
+    # Если зависимость не выполнена, команда пропускается
+    commands_by_id = dict(zip(ids, commands))
+    # В ответе — идентификаторы в том виде, в котором их прислал клиент
+    original_ids = {command_id: command.get('id', index)
+                    for index, (command_id, command) in enumerate(zip(ids, commands))}
+    dependents = {command_id: [] for command_id in ids}
+    for command_id in ids:
+        for dependency in dependencies[command_id]:
+            dependents[dependency].append(command_id)
+    remaining = {command_id: len(dependencies[command_id]) for command_id in ids}
+    results = {}
+    lock = threading.Lock()
+    all_done = threading.Event()
+
+    def finish(command_id, ok, message, elapsed_ms):
+        ready = []
+        with lock:
+            results[command_id] = {'id': original_ids[command_id], 'ok': ok, 'message': message, 'elapsed_ms': elapsed_ms}
+            for dependent in dependents[command_id]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+            if len(results) == len(ids):
+                all_done.set()
+        for dependent in ready:
+            schedule(dependent)
+
+    def schedule(command_id):
+        failed = [dependency for dependency in dependencies[command_id] if not results[dependency]['ok']]
+        if failed:
+            finish(command_id, False, f"Не выполнены зависимости: {', '.join(failed)}", 0.0)
+            return
+        command = commands_by_id[command_id]
+        on_done = lambda ok, message, elapsed_ms: finish(command_id, ok, message, elapsed_ms)
+        if not command_pool.submit(command['command_type'], run_command, command['command_type'],
+                                   command['command_name'], command.get('parameters', {}), on_done):
+            finish(command_id, False, QUEUE_FULL_MESSAGE, 0.0)
+
+    for command_id in ids:
+        if not dependencies[command_id]:
+            schedule(command_id)
+    all_done.wait()
+    return [results[command_id] for command_id in ids]
+
+@app.route('/execute/batch', methods=['POST'])
+def execute_batch_command():
+    data = request.get_json()
+    logging.info(f"Получен пакет команд: {data}")
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'Request body must be a JSON object'}), 400
+    validated = validate_batch(data.get('commands'))
+    if isinstance(validated, str):
+        return jsonify({'status': 'error', 'message': validated}), 400
+
+    started = time.perf_counter()
+    results = execute_batch(data['commands'], *validated)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    status = 'success' if all(result['ok'] for result in results) else 'partial'
+    logging.info(f"Пакет из {len(results)} команд выполнен за {elapsed_ms:.1f} мс, статус {status}")
+    return jsonify({'status': status, 'results': results, 'elapsed_ms': elapsed_ms}), 200
 
 def process_command(command_type, command_name, parameters):
+    # Возвращает (успех, описание результата)
     if command_type == 'start':
-        start_program(command_name, parameters)
+        return start_program(command_name, parameters)
     elif command_type == 'stop':
-        stop_program(command_name)
+        return stop_program(command_name)
     elif command_type == 'music':
-        handle_music_command(command_name, parameters)
+        return handle_music_command(command_name, parameters)
     else:
         logging.error(f"Неизвестный тип команды: {command_type}")
+        return False, f"Неизвестный тип команды: {command_type}"
 
-def handle_music_command(command_name, parameters={}):
-    global browser_driver
+music_command_messages = {
+    'play': "Музыка запущена",
+    'togglePause': "Музыка поставлена на паузу/продолжена",
+    'next': "Следующий трек",
+}
 
-    # Если браузер не запущен, открываем его
-    if browser_driver is None:
-        logging.info("Браузер не открыт, открываем браузер для музыки")
-        open_music_browser()
+def handle_music_command(command_name, parameters={}):
+    # Если браузер не запущен, поток music_browser откроет его перед командой
+    if command_name == 'setVolume':
+        volume_level = parameters.get('level', 5)  # По умолчанию 5
+        operation = ('setVolume', max(0, min(volume_level, 10)) / 10.0)
+        message = f"Громкость установлена на {volume_level}"
+    elif command_name in music_command_messages:
+        operation = (command_name, None)
+        message = music_command_messages[command_name]
+    else:
+        logging.error(f"Неизвестная команда для музыки: {command_name}")
+        return False, f"Неизвестная команда для музыки: {command_name}"
 
     try:
-        # Проверяем наличие externalAPI на странице
-        api_exists = browser_driver.execute_script("return typeof externalAPI !== 'undefined';")
-        if not api_exists:
-            logging.error("externalAPI не найден на странице.")
-            return
-
-        if command_name == 'play':
-            logging.info("Выполнение команды: externalAPI.play(1)")
-            browser_driver.execute_script("externalAPI.play(1);")
-            logging.info("Музыка запущена")
-        elif command_name == 'togglePause':
-            logging.info("Выполнение команды: externalAPI.togglePause()")
-            browser_driver.execute_script("externalAPI.togglePause();")
-            logging.info("Музыка поставлена на паузу/продолжена")
-        elif command_name == 'next':
-            logging.info("Выполнение команды: externalAPI.next()")
-            browser_driver.execute_script("externalAPI.next();")
-            logging.info("Следующий трек")
-        elif command_name == 'setVolume':
-            volume_level = parameters.get('level', 5)  # По умолчанию 5
-            volume = max(0, min(volume_level, 10)) / 10.0
-            logging.info(f"Выполнение команды: externalAPI.setVolume({volume})")
-            browser_driver.execute_script(f"externalAPI.setVolume({volume});")
-            logging.info(f"Громкость установлена на {volume_level}")
-        else:
-            logging.error(f"Неизвестная команда для музыки: {command_name}")
+        state = music_backend.submit(operation)
+    except TimeoutError as e:
+        logging.error(f"Команда музыки {command_name} не выполнена: {e}")
+        return False, str(e)
     except Exception as e:
         logging.error(f"Ошибка при выполнении команды музыки: {e}", exc_info=True)
+        return False, f"Ошибка при выполнении команды музыки: {e}"
+    logging.info(f"{message}, плеер: {state}")
+    return True, message
+
+def run_music_operations(driver, operations):
+    # Выполняется в потоке music_browser: весь пакет и чтение состояния плеера — один вызов WebDriver
+    logging.info(f"Выполнение команд музыки: {operations}")
+    return execute_music_script(driver, music_batch_script, operations)
+
+def execute_music_script(driver, script, *args):
+    # externalAPI проверяется после запуска, навигации или ошибки, а не перед каждой командой
+    if not music_browser.page_ready:
+        check_music_page(driver)
+        return driver.execute_script(script, *args)
+    try:
+        return driver.execute_script(script, *args)
+    except JavascriptException as e:
+        if 'externalAPI' not in str(e):
+            raise
+        # Страница сменилась без нашего ведома: проверяем её и повторяем вызов
+        logging.warning(f"externalAPI недоступен, проверяем страницу: {e.msg}")
+        music_browser.page_ready = False
+        check_music_page(driver)
+        return driver.execute_script(script, *args)
 
 def start_program(program_name, parameters):
     logging.info(f"Команда распознана: запуск {program_name}")
 
     if program_name == 'Музыка':
         # Открываем музыкальный браузер напрямую
-        open_music_browser()
+        if ensure_music_browser():
+            return True, "Браузер для музыки открыт"
+        return False, "Ошибка при открытии браузера для музыки"
     elif program_name == 'Google Chrome' and 'url' in parameters:
         # Используем Selenium для открытия браузера с URL
         url = parameters['url']
-        open_browser(url)
+        if open_browser(url):
+            return True, f"Открыт {url}"
+        return False, f"Ошибка при открытии {url}"
     else:
         try:
             program_path = programs[program_name]['start']
+            pid = running_programs.find(program_name)
+            if pid is not None:
+                return focus_program(program_name, pid)
             if program_path:  # Проверяем, что путь не пустой
                 # Если путь программы это строка с аргументами, разбить её
                 program_parts = program_path.split()
-                subprocess.Popen(program_parts, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                logging.info(f"{program_name} успешно запущен")
+                entry = process_registry.launch(program_name, program_parts)
+                logging.info(f"{program_name} успешно запущен (PID {entry['pid']})")
+                return True, f"{program_name} успешно запущен"
             else:
                 logging.error(f"Не указан путь для запуска программы {program_name}")
+                return False, f"Не указан путь для запуска программы {program_name}"
         except Exception as e:
             logging.error(f"Ошибка при запуске {program_name}: {e}")
+            return False, f"Ошибка при запуске {program_name}: {e}"
+
+def focus_program(program_name, pid):
+    focus_command = programs[program_name].get('focus')
+    if focus_command:
+        try:
+            process_registry.launch(f"{program_name} (фокус)", focus_command.split(), limited=False)
+        except OSError as e:
+            logging.warning(f"Не удалось переключиться на {program_name}: {e}")
+    logging.info(f"{program_name} уже запущен (PID {pid}), повторный запуск не нужен")
+    return True, f"{program_name} уже запущен"
 
 def stop_program(program_command):
-    global browser_driver
     logging.info(f"Команда распознана: выключение {program_command}")
     if program_command == 'music':
-        if browser_driver is not None:
-            try:
-                browser_driver.quit()
+        try:
+            if music_backend.close():
                 logging.info("Музыкальный браузер закрыт")
-                browser_driver = None
-            except Exception as e:
-                logging.error(f"Ошибка при закрытии музыкального браузера: {e}")
-        else:
+                return True, "Музыкальный браузер закрыт"
             logging.warning("Музыкальный браузер не запущен")
+            return True, "Музыкальный браузер не запущен"
+        except Exception as e:
+            logging.error(f"Ошибка при закрытии музыкального браузера: {e}")
+            return False, f"Ошибка при закрытии музыкального браузера: {e}"
     elif program_command == 'poweroff':
         try:
-            subprocess.Popen(["sudo", "/usr/sbin/poweroff"])
+            process_registry.launch('poweroff', ["sudo", "/usr/sbin/poweroff"], new_session=False, limited=False)
             logging.info("Система выключена")
+            return True, "Система выключена"
         except Exception as e:
             logging.error(f"Ошибка при выключении системы: {e}")
+            return False, f"Ошибка при выключении системы: {e}"
     else:
         try:
-            subprocess.Popen(["pkill", program_command])
-            logging.info(f"{program_command} успешно закрыт")
+            # Сначала процессы, запущенные через start_program, затем поиск по /proc.
+            # Запись реестра подходит, только если её процесс и есть программа, а не лаунчер.
+            # Собственные браузеры CommandExecutor ('chrome' находит и chromedriver) не трогаются
+            program_names = [name for name, info in programs.items() if info.get('stop') == program_command]
+            entries = process_registry.running(program_names, program_command)
+            if entries:
+                pids = [entry['pid'] for entry in entries]
+                graceful, forced = process_registry.stop(entries)
+            else:
+                pids, (graceful, forced) = process_table.stop(program_command, own_browser_pids())
+            if not pids:
+                logging.warning(f"{program_command} не запущен")
+                return True, f"{program_command} не запущен"
+            logging.info(f"{program_command} успешно закрыт (PID {pids}, завершено {graceful}, принудительно {forced})")
+            return True, f"{program_command} успешно закрыт"
         except Exception as e:
             logging.error(f"Ошибка при закрытии {program_command}: {e}")
+            return False, f"Ошибка при закрытии {program_command}: {e}"
 
 def open_browser(url):
+    # Ссылка открывается новой вкладкой в постоянном браузере web_browser
     logging.info(f"Открытие браузера с URL: {url}")
     try:
-        options = Options()
-        # options.add_argument('--headless')  # Закомментировано для запуска с UI
-        options.add_argument("user-data-dir=/home/alex/.config/google-chrome/Default")
-        driver = webdriver.Chrome(options=options)
-        driver.get(url)
-        # Keep the browser open or perform additional actions
-        driver.quit()
-        logging.info("Браузер успешно открыт и закрыт")
+        web_browser.call(open_url_tab, url)
+        logging.info("URL открыт в браузере")
+        return True
     except Exception as e:
         logging.error(f"Ошибка при открытии браузера: {e}")
+        return False
+
+def open_web_browser():
+    # Запуск Chrome для ссылок, вызывается только из потока web_browser
+    options = Options()
+    # options.add_argument('--headless')  # Закомментировано для запуска с UI
+    options.add_argument("user-data-dir=/home/alex/.config/google-chrome/Default")
+    driver = webdriver.Chrome(options=options)
+    driver.set_page_load_timeout(BROWSER_PAGE_LOAD_TIMEOUT_S)
+    driver.set_script_timeout(BROWSER_SCRIPT_TIMEOUT_S)
+    return driver
+
+def open_url_tab(driver, url):
+    # Выполняется в потоке web_browser
+    try:
+        if driver.current_url == 'data:,':
+            # Пустая стартовая вкладка только что запущенного браузера
+            driver.get(url)
+            return
+        driver.switch_to.new_window('tab')
+    except NoSuchWindowException:
+        # Пользователь закрыл вкладку, в которой мы были: переходим в оставшуюся
+        handles = driver.window_handles
+        if not handles:
+            raise
+        driver.switch_to.window(handles[-1])
+        driver.switch_to.new_window('tab')
+    driver.get(url)
+
+def web_browser_unused(driver):
+    # Выполняется в потоке web_browser. Браузер открыт с профилем пользователя, поэтому
+    # закрывается по простою, только если в нём не осталось вкладок, кроме пустой стартовой
+    handles = driver.window_handles
+    if len(handles) != 1:
+        return not handles
+    driver.switch_to.window(handles[0])
+    return driver.current_url == 'data:,'
+
+web_browser = BrowserActor('web', open_web_browser, WEB_BROWSER_IDLE_CLOSE_S, web_browser_unused)
 
 def open_music_browser():
-    global browser_driver
+    # Запуск Chrome для музыки, вызывается только из потока music_browser
     logging.info("Открытие браузера для музыки")
+    driver = None
     try:
         options = Options()
         # options.add_argument("--headless")
         options.add_argument("user-data-dir=/home/alex/.config/google-chrome-selenium")
-        browser_driver = webdriver.Chrome(options=options)
-        # browser_driver.set_page_load_timeout(15)
-        # browser_driver.set_script_timeout(15)
-        # browser_driver.implicitly_wait(15)
+        driver = webdriver.Chrome(options=options)
+        driver.set_page_load_timeout(BROWSER_PAGE_LOAD_TIMEOUT_S)
+        driver.set_script_timeout(BROWSER_SCRIPT_TIMEOUT_S)
+        # driver.implicitly_wait(15)
 
-        music_url = 'https://music.yandex.ru'
-        browser_driver.get(music_url)
+        driver.get(music_url)
 
         # Ожидаем загрузку страницы и доступность externalAPI
-        wait = WebDriverWait(browser_driver, 5)
-        wait.until(lambda driver: driver.execute_script("return typeof externalAPI !== 'undefined';"))
-
-        logging.info("Браузер для музыки успешно открыт")
+        wait = WebDriverWait(driver, 5)
+        wait.until(lambda driver: driver.execute_script(music_api_check_script))
     except Exception as e:
         logging.error(f"Ошибка при открытии браузера для музыки: {e}", exc_info=True)
-        browser_driver = None
+        # Chrome без externalAPI не нужен: закрываем, чтобы не оставлять лишний процесс
+        quit_driver(driver)
+        raise
+
+    logging.info("Браузер для музыки успешно открыт")
+    music_browser.page_ready = True
+    return driver
+
+music_browser = BrowserActor('music', open_music_browser)
+music_batcher = BrowserBatcher(music_browser, run_music_operations, MUSIC_COALESCE_MS)
+
+def quit_driver(driver):
+    if driver is None:
+        return
+    try:
+        driver.quit()
+    except Exception as e:
+        logging.warning(f"Ошибка при закрытии браузера: {e}")
+
+def check_music_page(driver):
+    # Выполняется в потоке music_browser. Если externalAPI пропал, страница загружается заново
+    if driver is None:
+        return False
+    if not driver.execute_script(music_api_check_script):
+        logging.warning("externalAPI пропал со страницы, загружаем музыку заново")
+        music_browser.page_ready = False
+        driver.get(music_url)
+        WebDriverWait(driver, 5).until(lambda driver: driver.execute_script(music_api_check_script))
+    music_browser.page_ready = True
+    return True
+
+def launch_devtools_chrome():
+    process_registry.launch('Chrome DevTools', [chrome_path, f"--remote-debugging-port={DEVTOOLS_PORT}",
+                                                f"--user-data-dir={devtools_profile_directory}",
+                                                "--no-first-run", music_url], limited=False)
+
+def music_batch_expression(operations):
+    # Тот же скрипт, что и для Selenium; операции подставляются как JSON-аргумент функции
+    return f"(function() {{{music_batch_script}}}).apply(null, {json.dumps([operations])})"
+
+class SeleniumMusicBackend:
+    # Вызовы идут через поток music_browser, одновременные команды собираются в один пакет
+    def submit(self, operation):
+        return music_batcher.submit(operation)
+
+    def ensure(self):
+        return music_browser.call(check_music_page)
+
+    def watch(self):
+        # Не открывает браузер, закрытый командой пользователя
+        music_browser.call(check_music_page, launch=None)
+
+    def close(self):
+        return music_browser.close()
+
+    def stats(self):
+        return music_browser.stats()
+
+class DevToolsMusicBackend:
+    # Команда — один Runtime.evaluate в постоянном соединении с вкладкой музыки.
+    # Готовность externalAPI сбрасывается событием навигации (Page.frameNavigated)
+    def __init__(self, host=DEVTOOLS_HOST, port=DEVTOOLS_PORT, launch=launch_devtools_chrome):
+        self.page = devtools.DevToolsPage(host, port, music_url, music_api_expression,
+                                          call_timeout=BROWSER_SCRIPT_TIMEOUT_S, launch=launch)
+        self.closed = False
+
+    def submit(self, operation):
+        self.closed = False
+        return self.page.evaluate(music_batch_expression([operation]))
+
+    def ensure(self):
+        self.closed = False
+        self.page.ensure()
+        return True
+
+    def watch(self):
+        if not self.closed:
+            self.page.ensure()
+
+    def close(self):
+        self.closed = True
+        return self.page.close()
+
+    def stats(self):
+        return self.page.stats()
+
+music_backend = DevToolsMusicBackend() if MUSIC_BACKEND == 'devtools' else SeleniumMusicBackend()
+
+def ensure_music_browser():
+    try:
+        return music_backend.ensure()
+    except Exception as e:
+        logging.error(f"Музыкальный браузер не готов: {e}")
+        return False
+
+def music_browser_watchdog():
+    # Браузер, закрытый командой пользователя, сторож не открывает
+    while True:
+        time.sleep(MUSIC_WATCHDOG_INTERVAL_S)
+        try:
+            music_backend.watch()
+        except Exception as e:
+            logging.error(f"Сторож музыкального браузера: {e}")
+
+def warm_music_browser():
+    started = time.perf_counter()
+    if ensure_music_browser():
+        logging.info(f"Музыкальный браузер прогрет за {time.perf_counter() - started:.1f} с")
+    music_browser_watchdog()
+
+def start_music_browser_warmup():
+    threading.Thread(target=warm_music_browser, name="music-browser-warmup", daemon=True).start()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    command_pool.start()
+    process_registry.start()
+    running_programs.start()
+    ipc.serve_commands(handle_socket_command)
+    serve_websocket_commands()
+    if WARM_MUSIC_BROWSER or '--warm-music' in sys.argv:
+        start_music_browser_warmup()
+    # HTTP остаётся запасным транспортом и слушает только локальный интерфейс
+    app.run(host='127.0.0.1', port=5000, request_handler=NoDelayRequestHandler)
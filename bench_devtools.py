@@ -0,0 +1,138 @@
+#Проверка и замер бэкенда музыки через DevTools на поддельном сервере DevTools
+# Использование: python bench_devtools.py [число команд]
+# Поднимает локально HTTP (/json/list, /json/new, /json/close) и WebSocket вкладки, которые
+# отвечают как Chrome со страницей музыки, и гоняет через DevToolsMusicBackend команды,
+# переход со страницы (событие Page.frameNavigated) и обрыв соединения.
+import json
+import re
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from websockets.sync.server import serve
+from CommandExecutor import DevToolsMusicBackend, music_url
+
+class FakeChrome:
+    # Одна вкладка; externalAPI «есть» только на странице музыки
+    def __init__(self):
+        self.url = music_url
+        self.open = True
+        self.player = {'playing': False, 'volume': 0.5, 'track': 'Трек 1'}
+        self.evaluations = 0
+        self.websocket = None
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', 0), self.http_handler())
+        self.websocket_server = serve(self.handle_websocket, '127.0.0.1', 0)
+        self.port = self.http_server.server_address[1]
+        websocket_port = self.websocket_server.socket.getsockname()[1]
+        self.websocket_url = f"ws://127.0.0.1:{websocket_port}/devtools/page/1"
+        for server in (self.http_server, self.websocket_server):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def targets(self):
+        if not self.open:
+            return []
+        return [{'id': '1', 'type': 'page', 'url': self.url, 'webSocketDebuggerUrl': self.websocket_url}]
+
+    def http_handler(self):
+        chrome = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith('/json/close/'):
+                    chrome.open = False
+                    body = b'Target is closing'
+                else:
+                    body = json.dumps(chrome.targets()).encode()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_PUT(self):
+                chrome.open, chrome.url = True, music_url
+                body = json.dumps(chrome.targets()[0]).encode()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def navigate(self, url):
+        self.url = url
+        if self.websocket is not None:
+            self.websocket.send(json.dumps({'method': 'Page.frameNavigated',
+                                            'params': {'frame': {'id': 'main', 'url': url}}}))
+
+    def evaluate(self, expression):
+        self.evaluations += 1
+        api = self.url.startswith(music_url)
+        if expression.startswith('typeof externalAPI'):
+            return {'result': {'type': 'boolean', 'value': api}}
+        if not api:
+            return {'result': {'type': 'object'}, 'exceptionDetails': {
+                'text': 'Uncaught', 'exception': {'description': 'ReferenceError: externalAPI is not defined'}}}
+        operations, = json.loads(re.search(r"\.apply\(null, (.*)\)$", expression, re.S).group(1))
+        for name, value in operations:
+            if name == 'play':
+                self.player['playing'] = True
+            elif name == 'togglePause':
+                self.player['playing'] = not self.player['playing']
+            elif name == 'next':
+                self.player['track'] = f"Трек {int(self.player['track'].split()[1]) + 1}"
+            elif name == 'setVolume':
+                self.player['volume'] = value
+        return {'result': {'type': 'object', 'value': dict(self.player)}}
+
+    def handle_websocket(self, websocket):
+        self.websocket = websocket
+        for raw_message in websocket:
+            message = json.loads(raw_message)
+            result = {}
+            if message['method'] == 'Runtime.evaluate':
+                result = self.evaluate(message['params']['expression'])
+            elif message['method'] == 'Page.navigate':
+                self.navigate(message['params']['url'])
+            websocket.send(json.dumps({'id': message['id'], 'result': result}))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    chrome = FakeChrome()
+    backend = DevToolsMusicBackend(port=chrome.port, launch=None)
+
+    state = backend.submit(('play', None))
+    assert state['playing'], state
+    evaluations = chrome.evaluations
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        backend.submit(('setVolume', 0.3))
+        timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+    print(f"Команда через DevTools: медиана {statistics.median(timings):.0f} мкс, "
+          f"p95 {timings[int(len(timings) * 0.95) - 1]:.0f} мкс ({count} команд)")
+    print(f"Вызовов Runtime.evaluate на команду: {(chrome.evaluations - evaluations) / count:.2f}")
+
+    # Переход со страницы: событие сбрасывает готовность, следующая команда возвращает музыку
+    chrome.navigate('https://example.com')
+    time.sleep(0.1)
+    assert not backend.page.ready
+    state = backend.submit(('next', None))
+    assert chrome.url == music_url and state['track'] == 'Трек 2', state
+    print("Переход со страницы: страница музыки открыта заново")
+
+    # Обрыв соединения: следующая команда подключается заново
+    chrome.websocket.close()
+    time.sleep(0.1)
+    backend.submit(('togglePause', None))
+    print(f"Обрыв соединения: переподключение, всего подключений {backend.page.connects}")
+
+    assert backend.close() and not chrome.open
+    print(f"Закрытие вкладки: ok, статистика {backend.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#Микробенчмарк разбора команд: прежний разбор из process_command против IntentMatcher
+# Использование: python bench_intents.py [logs/homai_voice.log]
+# Корпус берётся из строк лога "Распознанный текст: ..." / "Команда после активации: ...",
+# без аргумента используется встроенный набор фраз.
+import re
+import sys
+import timeit
+from intents import (IntentMatcher, programs, start_pattern, stop_pattern, music_play_pattern,
+                     music_pause_pattern, music_next_pattern, music_volume_pattern,
+                     number_words_to_digits)
+
+default_corpus = [
+    "включи музыку", "пауза", "продолжи", "следующий", "громкость пять", "громкость десять",
+    "открой браузер", "закрой браузер", "запусти терминал", "открой консоль",
+    "включи редактор", "закрой саблайм", "запусти стим", "закрой стим",
+    "запусти доту", "включи дотку", "выключи доту", "выключи компьютер",
+    "открой браузер https://example.com", "покажи погоду", "что сейчас играет",
+    "начать воспроизведение", "останови терминал", "прекрати дотан",
+]
+
+log_phrase_pattern = re.compile(r"(?:Распознанный текст|Команда после активации): (.+)$")
+
+def load_corpus(log_path):
+    corpus = []
+    with open(log_path, encoding='utf-8') as log:
+        for line in log:
+            match = log_phrase_pattern.search(line.rstrip("\n"))
+            if match and match.group(1).strip():
+                corpus.append(match.group(1).strip())
+    return corpus
+
+def legacy_match(text):
+    # Логика process_command до IntentMatcher, без отправки команды
+    for word, digit in number_words_to_digits.items():
+        text = re.sub(rf"\b{word}\b", str(digit), text)
+
+    volume_match = music_volume_pattern.search(text)
+    if volume_match:
+        return ('music', 'setVolume', {'level': int(volume_match.group(1))})
+    if music_play_pattern.search(text):
+        return ('music', 'play', {})
+    elif music_pause_pattern.search(text):
+        return ('music', 'togglePause', {})
+    elif music_next_pattern.search(text):
+        return ('music', 'next', {})
+
+    for program_keywords, program_info in programs.items():
+        program_pattern = r"\b(" + "|".join([re.escape(keyword) for keyword in program_keywords]) + r")\b"
+        if start_pattern.search(text) and re.search(program_pattern, text):
+            if 'start' in program_info:
+                return ('start', program_info['start'][0], {})
+            return None
+        if stop_pattern.search(text) and re.search(program_pattern, text):
+            if 'stop' in program_info:
+                return ('stop', program_info['stop'], {})
+            return None
+    return None
+
+def best_time(function, corpus, number, repeat=5):
+    return min(timeit.repeat(lambda: [function(text) for text in corpus], number=number, repeat=repeat))
+
+def main():
+    corpus = load_corpus(sys.argv[1]) if len(sys.argv) > 1 else default_corpus
+    if not corpus:
+        print("Корпус пуст")
+        return
+    matcher = IntentMatcher(programs)
+    number = max(1, 20000 // len(corpus))
+
+    legacy_time = best_time(legacy_match, corpus, number)
+    matcher_time = best_time(matcher.match, corpus, number)
+    calls = number * len(corpus)
+    print(f"Фраз в корпусе: {len(corpus)}, вызовов на прогон: {calls}")
+    print(f"process_command (прежний): {legacy_time / calls * 1e6:.2f} мкс/фраза")
+    print(f"IntentMatcher:             {matcher_time / calls * 1e6:.2f} мкс/фраза")
+    print(f"Ускорение: {legacy_time / matcher_time:.1f}x")
+
+    differences = []
+    for text in corpus:
+        intent = matcher.match(text)
+        new = tuple(intent) if intent else None
+        if new != legacy_match(text):
+            differences.append((text, legacy_match(text), new))
+    for text, old, new in differences:
+        print(f"Расхождение: '{text}': {old} -> {new}")
+
+    # Время поиска программы не должно расти с числом синонимов
+    for alias_count in (0, 100, 1000):
+        scaled = IntentMatcher(programs)
+        for alias_number in range(alias_count):
+            scaled.index.add(f"алиас{alias_number} программы", alias_number % len(scaled.index.programs))
+        scaled_time = best_time(scaled.match, corpus, number)
+        print(f"IntentMatcher, алиасов {alias_count}: {scaled_time / calls * 1e6:.2f} мкс/фраза")
+
+if __name__ == "__main__":
+    main()
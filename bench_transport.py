@@ -0,0 +1,41 @@
+#Сравнение задержки доставки команды CommandExecutor: Unix-сокет против HTTP
+# Использование: python bench_transport.py [число запросов]
+# Нужен запущенный CommandExecutor. Отправляется команда ping: сервер отвечает сразу, ничего не выполняя.
+import statistics
+import sys
+import time
+import requests
+import ipc
+
+http_url = 'http://localhost:5000/execute'
+
+def measure(send, count):
+    send()  # Прогрев: установка соединения
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        send()
+        timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    client = ipc.CommandSocketClient()
+    session = requests.Session()
+    payload = {'command_type': 'ping', 'command_name': 'ping', 'parameters': {}}
+
+    def send_socket():
+        ok, message = client.request('ping', 'ping', {})
+        assert ok, message
+
+    def send_http():
+        response = session.post(http_url, json=payload, timeout=2)
+        response.raise_for_status()
+
+    for name, send in (("Unix-сокет", send_socket), ("HTTP", send_http)):
+        median, p95 = measure(send, count)
+        print(f"{name:10}: медиана {median:.0f} мкс, p95 {p95:.0f} мкс ({count} запросов)")
+
+if __name__ == "__main__":
+    main()
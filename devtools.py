@@ -0,0 +1,278 @@
+#Управление вкладкой Chrome напрямую по протоколу DevTools, без chromedriver
+#
+# Chrome запускается с --remote-debugging-port. Список вкладок берётся по HTTP (/json/list),
+# дальше одно постоянное WebSocket-соединение с вкладкой:
+# запрос {id, method, params} -> ответ {id, result | error}, события приходят как {method, params}.
+import itertools
+import json
+import logging
+import threading
+import time
+import urllib.parse
+import urllib.request
+from websockets.sync.client import connect
+from websockets.exceptions import ConnectionClosed
+
+DEFAULT_PORT = 9222
+
+
+class DevToolsError(RuntimeError):
+    pass
+
+
+def http_request(host, port, path, method='GET', timeout=2.0):
+    request = urllib.request.Request(f"http://{host}:{port}{path}", method=method)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+def list_targets(host, port):
+    return json.loads(http_request(host, port, '/json/list'))
+
+def new_target(host, port, url):
+    # Новые версии Chrome принимают /json/new только методом PUT
+    return json.loads(http_request(host, port, '/json/new?' + urllib.parse.quote(url, safe=''), method='PUT'))
+
+def close_target(host, port, target_id):
+    http_request(host, port, f'/json/close/{target_id}')
+
+
+class DevToolsSession:
+    # Соединение с одной вкладкой. Поток чтения сопоставляет ответы с запросами по id
+    # и вызывает обработчики событий (в этом же потоке, поэтому они должны быть быстрыми)
+    def __init__(self, websocket_url, timeout=5.0):
+        self.websocket = connect(websocket_url, max_size=None, open_timeout=timeout)
+        self.closed = threading.Event()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._handlers = {}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._read, name="devtools-reader", daemon=True).start()
+
+    def on(self, method, handler):
+        self._handlers.setdefault(method, []).append(handler)
+
+    def send(self, method, params=None, timeout=5.0):
+        message_id = next(self._ids)
+        waiter = {'done': threading.Event(), 'message': None}
+        with self._lock:
+            if self.closed.is_set():
+                raise DevToolsError("Соединение DevTools закрыто")
+            self._pending[message_id] = waiter
+        try:
+            self.websocket.send(json.dumps({'id': message_id, 'method': method, 'params': params or {}}))
+        except ConnectionClosed as e:
+            with self._lock:
+                self._pending.pop(message_id, None)
+            raise DevToolsError(f"Соединение DevTools закрыто: {e}") from e
+        if not waiter['done'].wait(timeout):
+            with self._lock:
+                self._pending.pop(message_id, None)
+            raise TimeoutError(f"DevTools не ответил на {method} за {timeout} с")
+        message = waiter['message']
+        if message is None:
+            raise DevToolsError("Соединение DevTools закрыто")
+        if 'error' in message:
+            raise DevToolsError(f"{method}: {message['error'].get('message')}")
+        return message.get('result', {})
+
+    def evaluate(self, expression, timeout=5.0):
+        # Значение выражения; исключение в JavaScript превращается в DevToolsError
+        result = self.send('Runtime.evaluate', {'expression': expression, 'returnByValue': True}, timeout)
+        details = result.get('exceptionDetails')
+        if details:
+            description = details.get('exception', {}).get('description') or details.get('text')
+            raise DevToolsError(f"Ошибка JavaScript: {description}")
+        return result.get('result', {}).get('value')
+
+    def close(self):
+        self.websocket.close()
+
+    def _read(self):
+        try:
+            for raw_message in self.websocket:
+                message = json.loads(raw_message)
+                if 'id' in message:
+                    with self._lock:
+                        waiter = self._pending.pop(message['id'], None)
+                    if waiter is not None:
+                        waiter['message'] = message
+                        waiter['done'].set()
+                    continue
+                for handler in self._handlers.get(message.get('method'), ()):
+                    try:
+                        handler(message.get('params', {}))
+                    except Exception as e:
+                        logging.error(f"Ошибка обработчика события DevTools {message.get('method')}: {e}", exc_info=True)
+        except (ConnectionClosed, ValueError) as e:
+            logging.warning(f"Соединение DevTools прервано: {e}")
+        finally:
+            with self._lock:
+                self.closed.set()
+                pending = list(self._pending.values())
+                self._pending.clear()
+            for waiter in pending:
+                waiter['done'].set()
+
+
+class DevToolsPage:
+    # Вкладка со страницей page_url: находит её (или открывает), держит одно соединение
+    # и помнит, готова ли страница (ready_expression вернул true). Готовность сбрасывается
+    # событием навигации, закрытием соединения и ошибкой вызова, а не проверяется перед каждым
+    # evaluate. launch() запускает Chrome, если порт отладки не отвечает.
+    def __init__(self, host, port, page_url, ready_expression, ready_timeout=5.0, call_timeout=10.0,
+                 launch=None, launch_timeout=15.0):
+        self.host = host
+        self.port = port
+        self.page_url = page_url
+        self.ready_expression = ready_expression
+        self.ready_timeout = ready_timeout
+        self.call_timeout = call_timeout
+        self.launch = launch
+        self.launch_timeout = launch_timeout
+        self.session = None
+        self.target_id = None
+        self.ready = False
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.errors = 0
+        self.connects = 0
+        self.navigations = 0
+        self.call_ms_total = 0.0
+        self.call_ms_max = 0.0
+
+    def ensure(self):
+        with self._lock:
+            self._ensure_ready()
+
+    def evaluate(self, expression):
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                return self._evaluate(expression)
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                call_ms = (time.perf_counter() - started) * 1000
+                self.calls += 1
+                self.call_ms_total += call_ms
+                self.call_ms_max = max(self.call_ms_max, call_ms)
+
+    def close(self):
+        # True, если вкладка со страницей была открыта. Другие вкладки не трогаются
+        with self._lock:
+            self.ready = False
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+            try:
+                targets = list_targets(self.host, self.port)
+            except OSError:
+                return False
+            closed = False
+            for target in targets:
+                if target['id'] == self.target_id or target.get('url', '').startswith(self.page_url):
+                    close_target(self.host, self.port, target['id'])
+                    closed = True
+            self.target_id = None
+            return closed
+
+    def _evaluate(self, expression):
+        was_ready = self.ready
+        self._ensure_ready()
+        try:
+            return self.session.evaluate(expression, self.call_timeout)
+        except DevToolsError:
+            if not was_ready:
+                raise
+        # Страница считалась готовой, но вызов не прошёл: Chrome закрылся или страница сменилась
+        # без события. Если готовность подтвердится, ошибка настоящая и вызов не повторяется
+        self.ready = False
+        if self.session is not None and not self.session.closed.is_set():
+            if self.session.evaluate(self.ready_expression, self.call_timeout):
+                self.ready = True
+                raise
+        logging.warning("Страница DevTools не готова, подключаемся заново")
+        self._ensure_ready()
+        return self.session.evaluate(expression, self.call_timeout)
+
+    def _ensure_ready(self):
+        # Вызывается под self._lock
+        if self.session is None or self.session.closed.is_set():
+            self._connect()
+        if self.ready:
+            return
+        if not self.session.evaluate(self.ready_expression, self.call_timeout):
+            self._navigate()
+        self.ready = True
+
+    def _navigate(self):
+        self.navigations += 1
+        self.session.send('Page.navigate', {'url': self.page_url}, self.call_timeout)
+        deadline = time.monotonic() + self.ready_timeout
+        while not self.session.evaluate(self.ready_expression, self.call_timeout):
+            if time.monotonic() > deadline:
+                raise DevToolsError(f"Страница {self.page_url} не готова за {self.ready_timeout} с")
+            time.sleep(0.1)
+
+    def _connect(self):
+        self.ready = False
+        self.session = None
+        target = self._find_target(self._targets())
+        if target is None:
+            target = new_target(self.host, self.port, self.page_url)
+        session = DevToolsSession(target['webSocketDebuggerUrl'], self.call_timeout)
+        session.on('Page.frameNavigated', self._on_frame_navigated)
+        session.on('Inspector.detached', self._on_detached)
+        session.send('Page.enable', timeout=self.call_timeout)
+        self.session = session
+        self.target_id = target['id']
+        self.connects += 1
+        logging.info(f"Подключено к вкладке DevTools {target.get('url')}")
+
+    def _targets(self):
+        try:
+            return list_targets(self.host, self.port)
+        except OSError:
+            if self.launch is None:
+                raise
+        logging.info(f"Порт отладки {self.port} не отвечает, запускаем Chrome")
+        self.launch()
+        deadline = time.monotonic() + self.launch_timeout
+        while True:
+            time.sleep(0.2)
+            try:
+                return list_targets(self.host, self.port)
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+
+    def _find_target(self, targets):
+        # Вкладка со страницей, иначе любая вкладка (на неё будет выполнен переход)
+        pages = [target for target in targets if target.get('type') == 'page']
+        for target in pages:
+            if target.get('url', '').startswith(self.page_url):
+                return target
+        return pages[0] if pages else None
+
+    def _on_frame_navigated(self, params):
+        # Переход в главном фрейме: прежний JavaScript-контекст больше не существует
+        if 'parentId' not in params.get('frame', {}):
+            self.ready = False
+
+    def _on_detached(self, params):
+        self.ready = False
+
+    def stats(self):
+        calls = self.calls or 1
+        return {
+            'running': self.session is not None and not self.session.closed.is_set(),
+            'page_ready': self.ready,
+            'calls': self.calls,
+            'errors': self.errors,
+            'connects': self.connects,
+            'navigations': self.navigations,
+            'call_ms_avg': self.call_ms_total / calls,
+            'call_ms_max': self.call_ms_max,
+        }
@@ -0,0 +1,193 @@
+#Словарь голосовых команд и разбор фразы в намерение (intent)
+import re
+import logging
+from collections import namedtuple
+
+# Dictionary of programs and commands with synonyms
+programs = {
+    ('браузер', 'брауер', 'chrome'): {
+        'start': ('Google Chrome', '/usr/bin/google-chrome'),
+        'stop': 'chrome'
+    },
+    ('музыка', 'музыку', 'yandex'): {
+        'start': ('Музыка', None),
+        'stop': 'music'
+    },
+    ('редактор', 'саблайм', 'sublime', 'текстовый'): {
+        'start': ('Текстовый редактор', '/usr/bin/subl'),
+        'stop': 'subl'
+    },
+    ('терминал', 'консоль', 'terminator'): {
+        'start': ('Терминал', '/usr/bin/terminator'),
+        'stop': 'terminator'
+    },
+    ('стим', 'steam'): {
+        'start': ('Steam', '/usr/bin/steam'),
+        'stop': 'steam'
+    },
+    ('дота', 'доту', 'dota', 'дотан', 'дотанчик', 'дотку', 'дотка'): {
+        'start': ('Dota2', 'steam steam://rungameid/570'),
+        'stop': 'dota2'
+    },
+    ('ноут', 'ноутбук', 'комп', 'компьютер', 'shutdown', 'poweroff'): {
+        'stop': 'poweroff'
+    }
+}
+
+start_pattern = re.compile(r"(включ[иы]|запуст[иы]|откр[оа]й|покаж[иы]|откр[юу]|открыть|включить)")
+stop_pattern = re.compile(r"(выключ[иы]|закрыть|закр[оа]й|останов[иы]|прекрат[иы]|выключить)")
+music_play_pattern = re.compile(r"(включ[иыть] музы[ку]|нач[ао]ть воспроизвед[её]ние)")
+music_pause_pattern = re.compile(r"(пауз[ау]|продолж(и|ил|ить|ать|им|ишь|ит|им|ите|ат))")
+music_next_pattern = re.compile(r"(следующ(ий|ие|ее|ей))")
+music_volume_pattern = re.compile(r"громкость\s*(?P<level>\d+)")
+url_pattern = re.compile(r"\bhttps?://[^\s]+")
+
+# Словарь окна команды. Из него и таблицы programs собирается грамматика распознавателя,
+# поэтому при изменении паттернов выше эти списки нужно дополнить.
+start_verbs = ["включи", "запусти", "открой", "покажи", "открыть", "включить"]
+stop_verbs = ["выключи", "закрыть", "закрой", "останови", "прекрати", "выключить"]
+music_phrases = [
+    "включи музыку", "начать воспроизведение", "начни воспроизведение",
+    "пауза", "паузу", "продолжи", "продолжить", "продолжать", "продолжим", "продолжите",
+    "следующий", "следующие", "следующее", "следующей",
+]
+volume_word = "громкость"
+
+number_words_to_digits = {
+    'ноль': 0, 'один': 1, 'два': 2, 'три': 3, 'четыре': 4,
+    'пять': 5, 'шесть': 6, 'семь': 7, 'восемь': 8, 'девять': 9, 'десять': 10
+}
+number_words_pattern = re.compile(
+    r"\b(" + "|".join([re.escape(word) for word in number_words_to_digits]) + r")\b"
+)
+
+def replace_number_words_with_digits(text):
+    return number_words_pattern.sub(lambda match: str(number_words_to_digits[match.group(1)]), text)
+
+
+word_pattern = re.compile(r"\w+")
+
+def tokenize(text):
+    return word_pattern.findall(text.lower())
+
+
+class ProgramIndex:
+    # Префиксное дерево по словам: синоним (в том числе из нескольких слов) -> номер
+    # программы в таблице programs. Поиск идёт один раз по словам фразы, его время
+    # не зависит от числа программ и синонимов.
+    def __init__(self, programs):
+        self.programs = list(programs.items())
+        self.keywords = [list(program_keywords) for program_keywords, program_info in self.programs]
+        self._root = {}
+        for index, program_keywords in enumerate(self.keywords):
+            for keyword in program_keywords:
+                self._insert(keyword, index)
+
+    def _insert(self, phrase, index):
+        node = self._root
+        for token in tokenize(phrase):
+            node = node.setdefault(token, {})
+        node[None] = index  # None — конец синонима
+
+    def add(self, phrase, index):
+        phrase = phrase.strip().lower()
+        if phrase in self.keywords[index]:
+            return
+        self.keywords[index].append(phrase)
+        self._insert(phrase, index)
+
+    def find(self, phrase):
+        # Номер программы для точного синонима
+        node = self._root
+        for token in tokenize(phrase):
+            node = node.get(token)
+            if node is None:
+                return None
+        return node.get(None)
+
+    def load_aliases(self, file_path):
+        # Строки вида "алиас = известный синоним", пустые строки и # игнорируются
+        added = 0
+        with open(file_path, encoding='utf-8') as aliases:
+            for line_number, line in enumerate(aliases, 1):
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                alias, separator, target = line.partition('=')
+                index = self.find(target) if separator else None
+                if index is None or not tokenize(alias):
+                    logging.warning(f"{file_path}:{line_number}: не удалось разобрать алиас '{line}'")
+                    continue
+                self.add(alias, index)
+                added += 1
+        return added
+
+    def lookup(self, text):
+        # Первая по порядку таблицы программа, упомянутая во фразе
+        tokens = tokenize(text)
+        best = None
+        for start in range(len(tokens)):
+            node = self._root
+            for position in range(start, len(tokens)):
+                node = node.get(tokens[position])
+                if node is None:
+                    break
+                index = node.get(None)
+                if index is not None and (best is None or index < best):
+                    best = index
+        return best
+
+
+# Намерение в том виде, в котором его принимает CommandExecutor (/execute)
+Intent = namedtuple('Intent', ['command_type', 'command_name', 'parameters'])
+
+class IntentMatcher:
+    # Глаголы и музыкальные фразы собраны в одно регулярное выражение с именованными
+    # группами, программы ищутся по ProgramIndex: фраза разбирается за один проход.
+    # Приоритет как раньше: громкость, музыка, затем первая по порядку программа из таблицы.
+    def __init__(self, programs):
+        self.index = ProgramIndex(programs)
+        alternatives = [
+            f"(?P<url>{url_pattern.pattern})",
+            f"(?P<volume>{music_volume_pattern.pattern})",
+            f"(?P<play>{music_play_pattern.pattern})",
+            f"(?P<pause>{music_pause_pattern.pattern})",
+            f"(?P<next>{music_next_pattern.pattern})",
+            f"(?P<stop>{stop_pattern.pattern})",
+            f"(?P<start>{start_pattern.pattern})",
+        ]
+        self.pattern = re.compile("|".join(alternatives))
+
+    def match(self, text):
+        text = replace_number_words_with_digits(text)
+        found = {}
+        for match in self.pattern.finditer(text):
+            found.setdefault(match.lastgroup, match)
+
+        if 'volume' in found:
+            return Intent('music', 'setVolume', {'level': int(found['volume'].group('level'))})
+        if 'play' in found:
+            return Intent('music', 'play', {})
+        if 'pause' in found:
+            return Intent('music', 'togglePause', {})
+        if 'next' in found:
+            return Intent('music', 'next', {})
+        if 'start' not in found and 'stop' not in found:
+            return None
+
+        index = self.index.lookup(text)
+        if index is None:
+            return None
+        program_keywords, program_info = self.index.programs[index]
+        if 'start' in found:
+            if 'start' not in program_info:
+                return None
+            program_name, program_path = program_info['start']
+            parameters = {}
+            # For browser commands, pass the URL if one was recognized
+            if program_name == 'Google Chrome' and 'url' in found:
+                parameters['url'] = found['url'].group(0)
+            return Intent('start', program_name, parameters)
+        if 'stop' not in program_info:
+            return None
+        return Intent('stop', program_info['stop'], {})
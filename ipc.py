@@ -0,0 +1,157 @@
+#Локальный транспорт команд между voise.py и CommandExecutor: Unix-сокет и бинарные кадры
+#
+# Кадр: длина тела (4 байта, big-endian) + тело.
+# Запрос:  код типа команды (1 байт), длина имени (2 байта), имя в UTF-8, параметры в JSON (пусто, если их нет)
+# Ответ:   статус (1 байт, 0 — успех), сообщение в UTF-8
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+socket_path = "/tmp/homeai_command.sock"
+
+command_type_codes = {'ping': 0, 'start': 1, 'stop': 2, 'music': 3}
+command_type_names = {code: name for name, code in command_type_codes.items()}
+
+frame_header = struct.Struct(">I")
+request_header = struct.Struct(">BH")
+response_header = struct.Struct(">B")
+MAX_FRAME_BYTES = 64 * 1024
+
+
+class TransportUnavailable(ConnectionError):
+    # Команда точно не была доставлена — можно отправить её другим транспортом
+    pass
+
+
+def encode_request(command_type, command_name, parameters):
+    name = command_name.encode('utf-8')
+    params = json.dumps(parameters, ensure_ascii=False, separators=(',', ':')).encode('utf-8') if parameters else b''
+    body = request_header.pack(command_type_codes[command_type], len(name)) + name + params
+    return frame_header.pack(len(body)) + body
+
+def decode_request(body):
+    code, name_length = request_header.unpack_from(body)
+    offset = request_header.size
+    command_name = body[offset:offset + name_length].decode('utf-8')
+    params = body[offset + name_length:]
+    parameters = json.loads(params) if params else {}
+    return command_type_names.get(code), command_name, parameters
+
+def encode_response(ok, message):
+    body = response_header.pack(0 if ok else 1) + message.encode('utf-8')
+    return frame_header.pack(len(body)) + body
+
+def decode_response(body):
+    status, = response_header.unpack_from(body)
+    return status == 0, body[response_header.size:].decode('utf-8')
+
+def recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            return None
+        received += count
+    return buffer
+
+def read_frame(sock):
+    # Тело следующего кадра или None, если соединение закрыто
+    header = recv_exact(sock, frame_header.size)
+    if header is None:
+        return None
+    length, = frame_header.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"Слишком большой кадр: {length} байт")
+    return recv_exact(sock, length)
+
+
+class CommandRequestHandler(socketserver.BaseRequestHandler):
+    # Одно соединение — много кадров подряд, пока клиент его не закроет
+    def handle(self):
+        while True:
+            try:
+                body = read_frame(self.request)
+            except (OSError, ValueError) as e:
+                logging.error(f"Ошибка чтения команды из сокета: {e}")
+                return
+            if body is None:
+                return
+            try:
+                ok, message = self.server.command_handler(*decode_request(body))
+            except Exception as e:
+                logging.error(f"Ошибка обработки команды из сокета: {e}", exc_info=True)
+                ok, message = False, str(e)
+            self.request.sendall(encode_response(ok, message))
+
+
+class CommandSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, command_handler):
+        self.command_handler = command_handler
+        super().__init__(path, CommandRequestHandler)
+
+
+def serve_commands(command_handler, path=socket_path):
+    # command_handler(command_type, command_name, parameters) -> (успех, сообщение)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = CommandSocketServer(path, command_handler)
+    os.chmod(path, 0o600)
+    threading.Thread(target=server.serve_forever, name="command-socket", daemon=True).start()
+    logging.info(f"Приём команд через Unix-сокет {path}")
+    return server
+
+
+class CommandSocketClient:
+    # Постоянное соединение с CommandExecutor, переподключается при обрыве
+    def __init__(self, path=socket_path, timeout=2.0):
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def request(self, command_type, command_name, parameters):
+        frame = encode_request(command_type, command_name, parameters)
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall(frame)
+                    body = read_frame(self._sock)
+                except socket.timeout:
+                    # Кадр мог дойти: повторная отправка рискует выполнить команду дважды
+                    self.close()
+                    raise
+                except OSError as e:
+                    self.close()
+                    if attempt:
+                        raise TransportUnavailable(str(e)) from e
+                    continue
+                if body is not None:
+                    return decode_response(body)
+                # Сервер закрыл старое соединение (например, перезапуск) — переподключаемся
+                self.close()
+            raise TransportUnavailable("соединение закрыто сервером")
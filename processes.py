@@ -0,0 +1,366 @@
+#Программы, запущенные CommandExecutor: реестр по PID, надзор и остановка без pkill
+#
+# Каждая программа запускается в своей сессии (группе процессов), поэтому останавливается
+# вся группа: сначала SIGTERM, через STOP_GRACE_S — SIGKILL тем, кто не завершился.
+# Поток надзора ждёт завершения дочерних процессов через pidfd (или опросом, если pidfd
+# недоступен), забирает их код выхода, чтобы не копились зомби, и ведёт историю завершений.
+# Для процессов, запущенных не через CommandExecutor, есть поиск по снимку /proc.
+import logging
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+
+STOP_GRACE_S = 3.0  # Сколько ждать завершения после SIGTERM
+PROC_SCAN_TTL_S = 2.0  # Сколько секунд снимок /proc считается свежим
+MAX_RUNNING_PROGRAMS = 16  # Сколько программ может работать одновременно
+EXIT_HISTORY_SIZE = 50
+REAP_POLL_S = 5.0  # Период опроса процессов, для которых нет pidfd
+RUNNING_REFRESH_S = 5.0  # Период обновления списка запущенных программ
+
+
+def signal_group(pid, signum):
+    try:
+        os.killpg(pid, signum)
+    except ProcessLookupError:
+        pass
+
+def signal_pid(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+def read_process_stat(pid):
+    # (имя процесса, состояние, PID родителя) из /proc/<pid>/stat или None, если процесса нет
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            # "pid (имя) состояние ...", имя само может содержать скобки
+            process_stat = stat.read()
+    except OSError:
+        return None
+    process_name, _, rest = process_stat.partition(' (')[2].rpartition(')')
+    fields = rest.split()
+    if len(fields) < 2:
+        return None
+    return process_name, fields[0], int(fields[1])
+
+def pid_matches(pid, name):
+    # Живой процесс, имя которого начинается с name (как при поиске по /proc).
+    # Зомби считается завершённым: его осталось только дождаться родителю
+    stat = read_process_stat(pid)
+    return stat is not None and stat[1] != 'Z' and stat[0].startswith(name)
+
+def terminate(targets, grace=STOP_GRACE_S):
+    # targets — список (send_signal(signum), is_alive()). Возвращает число завершённых
+    # по SIGTERM и число добитых SIGKILL
+    for send_signal, is_alive in targets:
+        send_signal(signal.SIGTERM)
+    deadline = time.monotonic() + grace
+    while time.monotonic() < deadline and any(is_alive() for send_signal, is_alive in targets):
+        time.sleep(0.05)
+    forced = [(send_signal, is_alive) for send_signal, is_alive in targets if is_alive()]
+    for send_signal, is_alive in forced:
+        send_signal(signal.SIGKILL)
+    return len(targets) - len(forced), len(forced)
+
+def open_pidfd(pid):
+    # None, если ядро или Python не поддерживают pidfd
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+class LaunchLimitError(RuntimeError):
+    pass
+
+
+class ProcessRegistry:
+    # PID -> запись {pid, program, command, started_at, process, limited}. Запись удаляется
+    # и попадает в историю завершений, когда процесс завершился: это замечает поток надзора,
+    # остановка или running(). В лимит max_running входят только записи с limited=True
+    # (и запуски, которые ещё идут: место занимается до Popen)
+    def __init__(self, max_running=MAX_RUNNING_PROGRAMS, history_size=EXIT_HISTORY_SIZE):
+        self.max_running = max_running
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._limited = 0
+        self._new_pidfds = []
+        self._wake_read, self._wake_write = os.pipe()
+        self._thread = None
+
+        self.exits = deque(maxlen=history_size)
+        self.launched = 0
+        self.refused = 0
+        self.exited = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._supervise, name="process-supervisor", daemon=True)
+                self._thread.start()
+
+    def launch(self, program_name, command, new_session=True, limited=True):
+        # limited=False — служебный процесс (например, выключение), он не упирается в лимит
+        with self._lock:
+            if limited:
+                if self._limited >= self.max_running:
+                    self.refused += 1
+                    raise LaunchLimitError(f"Уже запущено {self._limited} программ, лимит {self.max_running}")
+                self._limited += 1
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                       start_new_session=new_session)
+        except Exception:
+            if limited:
+                with self._lock:
+                    self._limited -= 1
+            raise
+        entry = {'pid': process.pid, 'program': program_name, 'command': command, 'limited': limited,
+                 'started_at': time.time(), 'process': process, 'pidfd': open_pidfd(process.pid)}
+        with self._lock:
+            self._entries[process.pid] = entry
+            self.launched += 1
+            if entry['pidfd'] is not None:
+                self._new_pidfds.append((entry['pidfd'], process.pid))
+        os.write(self._wake_write, b'\0')
+        return entry
+
+    def _finish(self, pid):
+        # Забирает код выхода завершившегося процесса и переносит запись в историю
+        with self._lock:
+            entry = self._entries.pop(pid, None)
+            if entry is not None and entry['limited']:
+                self._limited -= 1
+        if entry is None:
+            return
+        returncode = entry['process'].wait()
+        duration_s = time.time() - entry['started_at']
+        with self._lock:
+            self.exited += 1
+            self.exits.append({'pid': pid, 'program': entry['program'], 'exit_code': returncode,
+                               'duration_s': round(duration_s, 1), 'finished_at': time.time()})
+        logging.info(f"{entry['program']} (PID {pid}) завершился с кодом {returncode} через {duration_s:.1f} с")
+
+    def _supervise(self):
+        poller = select.poll()
+        poller.register(self._wake_read, select.POLLIN)
+        pidfds = {}
+        while True:
+            with self._lock:
+                new_pidfds, self._new_pidfds = self._new_pidfds, []
+                polled = [pid for pid, entry in self._entries.items() if entry['pidfd'] is None]
+            for pidfd, pid in new_pidfds:
+                pidfds[pidfd] = pid
+                poller.register(pidfd, select.POLLIN)
+            for pid in polled:
+                entry = self._entries.get(pid)
+                if entry is not None and entry['process'].poll() is not None:
+                    self._finish(pid)
+            timeout = REAP_POLL_S * 1000 if polled else None
+            for fd, event in poller.poll(timeout):
+                if fd == self._wake_read:
+                    os.read(self._wake_read, 4096)
+                    continue
+                # pidfd становится читаемым, когда процесс завершился
+                poller.unregister(fd)
+                os.close(fd)
+                self._finish(pidfds.pop(fd))
+
+    def running(self, program_names=None, process_name=None):
+        # Живые записи (для указанных программ); завершившиеся убираются из реестра.
+        # process_name — только записи, чей процесс сейчас называется так (по началу имени):
+        # запуск через лаунчер (Dota2 через steam) записан под программой, но сам процесс —
+        # лаунчер, и останавливать или считать запущенной программу по нему нельзя
+        with self._lock:
+            entries = list(self._entries.values())
+        alive = []
+        for entry in entries:
+            if entry['process'].poll() is None:
+                if program_names is not None and entry['program'] not in program_names:
+                    continue
+                if process_name is None or pid_matches(entry['pid'], process_name):
+                    alive.append(entry)
+            else:
+                self._finish(entry['pid'])
+        return alive
+
+    def stop(self, entries, grace=STOP_GRACE_S):
+        targets = [(lambda signum, pid=entry['pid']: signal_group(pid, signum),
+                    lambda process=entry['process']: process.poll() is None)
+                   for entry in entries]
+        graceful, forced = terminate(targets, grace)
+        for entry in entries:
+            try:
+                entry['process'].wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                logging.error(f"{entry['program']} (PID {entry['pid']}) не завершился после SIGKILL")
+                continue
+            self._finish(entry['pid'])
+        return graceful, forced
+
+    def snapshot(self):
+        return [{'pid': entry['pid'], 'program': entry['program'], 'command': entry['command'],
+                 'started_at': entry['started_at']} for entry in self.running()]
+
+    def stats(self):
+        running = self.snapshot()
+        with self._lock:
+            return {
+                'running': running,
+                'limited_running': self._limited,
+                'max_running': self.max_running,
+                'launched': self.launched,
+                'refused': self.refused,
+                'exited': self.exited,
+                'supervised_by': 'pidfd' if hasattr(os, 'pidfd_open') else 'poll',
+                'recent_exits': list(self.exits),
+            }
+
+
+def scan_processes():
+    # (pid, имя процесса, PID родителя) для живых процессов текущего пользователя, кроме самого CommandExecutor
+    uid = os.getuid()
+    own_pid = os.getpid()
+    found = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit() or int(name) == own_pid:
+            continue
+        try:
+            if os.stat(f"/proc/{name}").st_uid != uid:
+                continue
+        except OSError:
+            continue
+        stat = read_process_stat(name)
+        if stat is not None and stat[1] != 'Z':
+            found.append((int(name), stat[0], stat[2]))
+    return found
+
+def descendants(processes, roots):
+    # PID процессов roots и всех их потомков по снимку scan_processes()
+    children = {}
+    for pid, process_name, parent_pid in processes:
+        children.setdefault(parent_pid, []).append(pid)
+    found = set()
+    pending = list(roots)
+    while pending:
+        pid = pending.pop()
+        if pid not in found:
+            found.add(pid)
+            pending.extend(children.get(pid, ()))
+    return found
+
+
+class ProcessTable:
+    # Снимок /proc, который перечитывается не чаще раза в ttl секунд
+    def __init__(self, ttl=PROC_SCAN_TTL_S):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._processes = None
+        self._taken_at = 0.0
+
+    def snapshot(self, fresh=False):
+        with self._lock:
+            if fresh or self._processes is None or time.monotonic() - self._taken_at > self.ttl:
+                self._processes = scan_processes()
+                self._taken_at = time.monotonic()
+            return self._processes
+
+    def invalidate(self):
+        with self._lock:
+            self._processes = None
+
+    def find(self, name, own_pids=()):
+        # Как pkill по имени, но только с начала имени: 'subl' находит sublime_text, 'steam' — steamwebhelper.
+        # Снимок мог устареть до запуска процесса, поэтому промах перепроверяется свежим снимком.
+        # own_pids — собственные процессы CommandExecutor: они и их потомки не находятся
+        pids = self._matching(self.snapshot(), name, own_pids)
+        if not pids:
+            pids = self._matching(self.snapshot(fresh=True), name, own_pids)
+        return pids
+
+    def _matching(self, processes, name, own_pids):
+        own = descendants(processes, own_pids)
+        return [pid for pid, process_name, parent_pid in processes
+                if process_name.startswith(name) and pid not in own]
+
+    def stop(self, name, own_pids=(), grace=STOP_GRACE_S):
+        # Снимок мог устареть: PID перепроверяется по имени, чтобы не убить процесс, получивший
+        # тот же PID после завершения прежнего
+        pids = [pid for pid in self.find(name, own_pids) if pid_matches(pid, name)]
+        targets = [(lambda signum, pid=pid: signal_pid(pid, signum), lambda pid=pid: pid_matches(pid, name))
+                   for pid in pids]
+        result = terminate(targets, grace)
+        self.invalidate()
+        return pids, result
+
+
+class RunningPrograms:
+    # Какие программы уже работают: программа -> PID. Индекс по снимку /proc строится фоновым
+    # потоком раз в refresh_s, программы из реестра проверяются сразу, а попадание в индекс
+    # перепроверяется по /proc/<pid>, чтобы завершившийся процесс не считался запущенным.
+    # process_names: программа -> начало имени процесса (как для остановки).
+    # own_pids() — PID собственных процессов CommandExecutor (например, chromedriver): они
+    # и их потомки не попадают в индекс, иначе свой Chrome считался бы запущенным Google Chrome
+    def __init__(self, process_names, registry, table, own_pids=None, refresh_s=RUNNING_REFRESH_S):
+        self.process_names = dict(process_names)
+        self.registry = registry
+        self.table = table
+        self.own_pids = own_pids
+        self.refresh_s = refresh_s
+        self._lock = threading.Lock()
+        self._index = {}
+        self._refreshed_at = None
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="running-programs", daemon=True)
+                self._thread.start()
+
+    def refresh(self):
+        index = {}
+        processes = self.table.snapshot(fresh=True)
+        own = descendants(processes, self.own_pids()) if self.own_pids is not None else set()
+        for pid, process_name, parent_pid in processes:
+            if pid in own:
+                continue
+            for program_name, name in self.process_names.items():
+                if process_name.startswith(name):
+                    index.setdefault(program_name, []).append(pid)
+        with self._lock:
+            self._index = index
+            self._refreshed_at = time.monotonic()
+
+    def find(self, program_name):
+        # PID работающей программы или None. Запись реестра учитывается, только если её процесс
+        # и есть программа, а не лаунчер; PID из индекса мог завершиться или смениться
+        name = self.process_names.get(program_name)
+        entries = self.registry.running([program_name], name)
+        if entries:
+            return entries[0]['pid']
+        with self._lock:
+            pids = list(self._index.get(program_name, ()))
+        for pid in pids:
+            if pid_matches(pid, name):
+                return pid
+        return None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Ошибка обновления списка запущенных программ: {e}", exc_info=True)
+            time.sleep(self.refresh_s)
+
+    def stats(self):
+        with self._lock:
+            age = None if self._refreshed_at is None else round(time.monotonic() - self._refreshed_at, 1)
+            return {'programs': {program_name: pids for program_name, pids in self._index.items()},
+                    'refreshed_s_ago': age}
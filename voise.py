@@ -1,5 +1,6 @@
 #Модуль для записи и воспроизведения звука
 import sounddevice as sd
+import numpy as np
 import queue
 import re
 import soundfile as sf  # For playing sound
@@ -7,8 +8,17 @@ import logging
 import os
 import sys
 import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
 import requests  # For sending REST API requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from vosk import Model, KaldiRecognizer
+from websockets.sync.client import connect as connect_websocket
+import ipc
+from intents import (IntentMatcher, programs, start_verbs, stop_verbs, music_phrases,
+                     volume_word, number_words_to_digits)
 
 # Configure logging
 log_directory = "logs"
@@ -23,12 +33,342 @@ logging.basicConfig(
     ]
 )
 
-q = queue.Queue()
+# Параметры захвата звука
+SAMPLE_RATE = 16000
+BLOCK_FRAMES = 4000  # 250 мс на блок
+RING_SLOTS = 32  # ~8 секунд аудио, дальше блоки отбрасываются
+STATS_INTERVAL = 240  # Блоков между выводом статистики буфера (~1 минута)
+
+# Политика при отставании распознавания от реального времени (задержка в мс)
+OVERLOAD_DROP_SILENCE_MS = 500  # Выше этой задержки тихие блоки пропускаются
+OVERLOAD_COALESCE_MS = 1000  # Выше этой задержки блоки склеиваются в один вызов AcceptWaveform
+OVERLOAD_COALESCE_BLOCKS = 4
+OVERLOAD_MAX_LAG_MS = 2000  # Выше этой задержки отбрасываются самые старые блоки
+SILENCE_RMS = 300  # Порог тишины (RMS по int16)
+
+# Блоки, записанные во время звукового сигнала: 'skip', 'attenuate' или 'keep'
+PLAYBACK_FRAME_POLICY = 'attenuate'
+PLAYBACK_GAIN = 0.3
+FRAME_PLAYBACK = 1  # Флаг блока: записан во время воспроизведения сигнала
+
+# Детектор речи перед AcceptWaveform: в тишине распознаватель не вызывается
+VAD_ENABLED = True
+VAD_FRAME_MS = 10
+VAD_ENERGY_RMS = 300  # Минимальная энергия речевого кадра (RMS по int16)
+VAD_LOUD_RMS = 1500  # Кадр громче этого считается речью при любом ZCR
+VAD_MAX_ZCR = 0.35  # Доля пересечений нуля; выше — шум/шипение
+VAD_MIN_SPEECH_FRAMES = 3  # Речевых кадров в блоке, чтобы считать его речью
+VAD_HANGOVER_BLOCKS = 4  # Блоков после речи, которые ещё отдаются распознавателю (конец фразы)
+VAD_PREROLL_BLOCKS = 2  # Блоков тишины перед речью, которые отдаются вместе с ней
+
+
+class AudioRingBuffer:
+    # Предвыделенный кольцевой буфер блоков int16. callback копирует данные в готовый
+    # слот без выделения памяти, recognize_loop получает сам слот без копирования.
+    # Слот, выданный read(), не перезаписывается до следующего вызова read().
+    def __init__(self, slots, block_frames, sample_width=2):
+        self.slots = slots
+        self.block_bytes = block_frames * sample_width
+        # bytearray передаётся в vosk (cffi, char *) напрямую, без копирования
+        self._buffers = [bytearray(self.block_bytes) for _ in range(slots)]
+        self._views = [memoryview(buffer) for buffer in self._buffers]
+        self._lengths = [0] * slots
+        self._flags = [0] * slots
+        self._write_index = 0
+        self._read_index = 0
+        self._holding = False
+        self._cond = threading.Condition()
+        self.current_flags = 0  # Флаги слота, выданного последним read()
+
+        self.written = 0
+        self.overruns = 0
+        self.max_fill = 0
+
+    def write(self, indata, flags=0):
+        nbytes = min(len(indata), self.block_bytes)
+        with self._cond:
+            fill = self._write_index - self._read_index
+            if fill >= self.slots:
+                # Распознавание не успевает: отбрасываем новый блок, память не растёт
+                self.overruns += 1
+                return False
+            slot = self._write_index % self.slots
+            if nbytes == self.block_bytes:
+                self._views[slot][:] = indata
+            else:
+                self._views[slot][:nbytes] = memoryview(indata)[:nbytes]
+            self._lengths[slot] = nbytes
+            self._flags[slot] = flags
+            self._write_index += 1
+            self.written += 1
+            if fill + 1 > self.max_fill:
+                self.max_fill = fill + 1
+            self._cond.notify()
+        return True
+
+    def read(self, timeout=None):
+        with self._cond:
+            # Освобождаем слот, выданный предыдущим вызовом
+            if self._holding:
+                self._read_index += 1
+                self._holding = False
+            if not self._cond.wait_for(lambda: self._write_index != self._read_index, timeout):
+                return None
+            slot = self._read_index % self.slots
+            length = self._lengths[slot]
+            self.current_flags = self._flags[slot]
+            self._holding = True
+        if length == self.block_bytes:
+            return self._buffers[slot]
+        return bytearray(self._views[slot][:length])
+
+    def skip(self, count):
+        # Отбрасывает выданный слот и ещё до count-1 самых старых блоков
+        with self._cond:
+            skipped = 0
+            if self._holding:
+                self._read_index += 1
+                self._holding = False
+                skipped += 1
+            pending = self._write_index - self._read_index
+            extra = max(0, min(count - skipped, pending))
+            self._read_index += extra
+            return skipped + extra
+
+    @property
+    def fill(self):
+        with self._cond:
+            return self._write_index - self._read_index
+
+    def stats(self):
+        with self._cond:
+            return {
+                'fill': self._write_index - self._read_index,
+                'max_fill': self.max_fill,
+                'slots': self.slots,
+                'written': self.written,
+                'overruns': self.overruns,
+            }
+
+
+class BackpressureReader:
+    # Читает блоки из AudioRingBuffer и ограничивает задержку распознавания.
+    # По мере роста отставания: сначала пропускает тишину, затем склеивает блоки,
+    # затем отбрасывает самое старое аудио.
+    def __init__(self, buffer, block_frames, sample_rate,
+                 drop_silence_ms=OVERLOAD_DROP_SILENCE_MS,
+                 coalesce_ms=OVERLOAD_COALESCE_MS,
+                 coalesce_blocks=OVERLOAD_COALESCE_BLOCKS,
+                 max_lag_ms=OVERLOAD_MAX_LAG_MS,
+                 silence_rms=SILENCE_RMS,
+                 playback_policy=PLAYBACK_FRAME_POLICY,
+                 playback_gain=PLAYBACK_GAIN):
+        self.buffer = buffer
+        self.block_ms = block_frames * 1000 / sample_rate
+        self.drop_silence_ms = drop_silence_ms
+        self.coalesce_ms = coalesce_ms
+        self.coalesce_blocks = coalesce_blocks
+        self.max_lag_ms = max_lag_ms
+        self.silence_rms = silence_rms
+        self.playback_policy = playback_policy
+        self.playback_gain = playback_gain
+        self._coalesce_buffer = bytearray(buffer.block_bytes * coalesce_blocks)
+        self._coalesce_view = memoryview(self._coalesce_buffer)
+        self._previous_silent = False
+
+        self.lag_ms = 0
+        self.max_seen_lag_ms = 0
+        self.dropped_silent = 0
+        self.dropped_oldest = 0
+        self.coalesced = 0
+        self.skipped_playback = 0
+        self.attenuated_playback = 0
+
+    def is_silent(self, data):
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        return np.sqrt(np.mean(samples * samples)) < self.silence_rms
+
+    def attenuate(self, data):
+        # Приглушаем блок на месте, прямо в слоте буфера
+        samples = np.frombuffer(data, dtype=np.int16)
+        np.multiply(samples, self.playback_gain, out=samples, casting='unsafe')
+
+    def read(self):
+        chunk_bytes = 0
+        chunk_blocks = 0
+        while True:
+            data = self.buffer.read(timeout=0 if chunk_blocks else None)
+            if data is None:
+                break
+            lag_ms = self.buffer.fill * self.block_ms
+            self.lag_ms = lag_ms
+            if lag_ms > self.max_seen_lag_ms:
+                self.max_seen_lag_ms = lag_ms
+
+            if lag_ms > self.max_lag_ms:
+                excess = int((lag_ms - self.coalesce_ms) // self.block_ms)
+                self.dropped_oldest += self.buffer.skip(excess)
+                continue
+
+            if self.buffer.current_flags & FRAME_PLAYBACK:
+                if self.playback_policy == 'skip':
+                    self.skipped_playback += 1
+                    continue
+                if self.playback_policy == 'attenuate':
+                    self.attenuate(data)
+                    self.attenuated_playback += 1
+
+            if lag_ms > self.drop_silence_ms:
+                silent = self.is_silent(data)
+                # Первый тихий блок после речи пропускаем в распознаватель, чтобы сработал конец фразы
+                if silent and self._previous_silent:
+                    self.dropped_silent += 1
+                    continue
+                self._previous_silent = silent
+            else:
+                self._previous_silent = False
+
+            if not chunk_blocks and lag_ms <= self.coalesce_ms:
+                return data
+
+            self._coalesce_view[chunk_bytes:chunk_bytes + len(data)] = data
+            chunk_bytes += len(data)
+            chunk_blocks += 1
+            if chunk_blocks >= self.coalesce_blocks:
+                break
+
+        self.coalesced += chunk_blocks - 1
+        if chunk_bytes == len(self._coalesce_buffer):
+            return self._coalesce_buffer
+        return bytes(self._coalesce_view[:chunk_bytes])
+
+    def stats(self):
+        return {
+            'lag_ms': self.lag_ms,
+            'max_lag_ms': self.max_seen_lag_ms,
+            'dropped_silent': self.dropped_silent,
+            'dropped_oldest': self.dropped_oldest,
+            'coalesced': self.coalesced,
+            'skipped_playback': self.skipped_playback,
+            'attenuated_playback': self.attenuated_playback,
+        }
+
+
+class VoiceActivityGate:
+    # Решает по энергии и числу пересечений нуля (по кадрам VAD_FRAME_MS), нужно ли
+    # отдавать блок распознавателю. Последние блоки тишины хранятся в предвыделенном
+    # буфере и отдаются перед первым речевым блоком, чтобы не обрезать начало слова.
+    def __init__(self, max_chunk_bytes, sample_rate,
+                 frame_ms=VAD_FRAME_MS,
+                 energy_rms=VAD_ENERGY_RMS,
+                 loud_rms=VAD_LOUD_RMS,
+                 max_zcr=VAD_MAX_ZCR,
+                 min_speech_frames=VAD_MIN_SPEECH_FRAMES,
+                 hangover_blocks=VAD_HANGOVER_BLOCKS,
+                 preroll_blocks=VAD_PREROLL_BLOCKS):
+        self.frame_samples = int(sample_rate * frame_ms / 1000)
+        self.energy_rms = energy_rms
+        self.loud_rms = loud_rms
+        self.max_zcr = max_zcr
+        self.min_speech_frames = min_speech_frames
+        self.hangover_blocks = hangover_blocks
+        self._hangover = 0
+        self._preroll = [bytearray(max_chunk_bytes) for _ in range(preroll_blocks)]
+        self._preroll_views = [memoryview(buffer) for buffer in self._preroll]
+        self._preroll_lengths = [0] * preroll_blocks
+        self._preroll_count = 0
+        self._preroll_index = 0
+
+        self.total_bytes = 0
+        self.skipped_bytes = 0
+
+    def is_speech(self, data):
+        samples = np.frombuffer(data, dtype=np.int16)
+        usable = len(samples) - len(samples) % self.frame_samples
+        frames = samples[:usable].reshape(-1, self.frame_samples).astype(np.float32)
+        energy = np.sqrt(np.mean(frames * frames, axis=1))
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / self.frame_samples
+        voiced = ((energy > self.energy_rms) & (zcr < self.max_zcr)) | (energy > self.loud_rms)
+        return np.count_nonzero(voiced) >= self.min_speech_frames
+
+    def process(self, data):
+        # Возвращает список фрагментов для распознавателя (пустой — блок пропущен)
+        self.total_bytes += len(data)
+        if self.is_speech(data):
+            self._hangover = self.hangover_blocks
+            chunks = self._drain_preroll()
+            chunks.append(data)
+            return chunks
+        if self._hangover > 0:
+            self._hangover -= 1
+            return [data]
+        self._store_preroll(data)
+        self.skipped_bytes += len(data)
+        return []
+
+    def _store_preroll(self, data):
+        if not self._preroll:
+            return
+        index = self._preroll_index
+        self._preroll_views[index][:len(data)] = data
+        self._preroll_lengths[index] = len(data)
+        self._preroll_index = (index + 1) % len(self._preroll)
+        self._preroll_count = min(self._preroll_count + 1, len(self._preroll))
+
+    def _drain_preroll(self):
+        chunks = []
+        start = self._preroll_index - self._preroll_count
+        for offset in range(self._preroll_count):
+            index = (start + offset) % len(self._preroll)
+            length = self._preroll_lengths[index]
+            if length == len(self._preroll[index]):
+                chunks.append(self._preroll[index])
+            else:
+                chunks.append(bytearray(self._preroll_views[index][:length]))
+            self.skipped_bytes -= length
+        self._preroll_count = 0
+        return chunks
+
+    def stats(self):
+        skipped_share = self.skipped_bytes / self.total_bytes if self.total_bytes else 0.0
+        return {
+            'total_bytes': self.total_bytes,
+            'skipped_bytes': self.skipped_bytes,
+            'skipped_share': skipped_share,
+        }
+
+
+audio_buffer = AudioRingBuffer(RING_SLOTS, BLOCK_FRAMES)
+audio_reader = BackpressureReader(audio_buffer, BLOCK_FRAMES, SAMPLE_RATE)
+vad_gate = VoiceActivityGate(audio_buffer.block_bytes * OVERLOAD_COALESCE_BLOCKS, SAMPLE_RATE)
 
 def callback(indata, frames, time_info, status):
     if status:
         logging.warning(f"Audio stream status: {status}")
-    q.put(bytes(indata))
+    audio_buffer.write(indata, FRAME_PLAYBACK if alert_player.playing.is_set() else 0)
+
+def log_buffer_stats(last_overruns):
+    stats = audio_buffer.stats()
+    if stats['overruns'] > last_overruns:
+        logging.warning(f"Переполнение аудиобуфера: потеряно блоков {stats['overruns'] - last_overruns}, "
+                        f"всего {stats['overruns']}")
+    logging.debug(f"Аудиобуфер: заполнено {stats['fill']}/{stats['slots']}, "
+                  f"максимум {stats['max_fill']}, записано {stats['written']}")
+    reader_stats = audio_reader.stats()
+    logging.debug(f"Задержка распознавания: {reader_stats['lag_ms']:.0f} мс "
+                  f"(максимум {reader_stats['max_lag_ms']:.0f} мс), "
+                  f"пропущено тишины {reader_stats['dropped_silent']}, "
+                  f"отброшено старых {reader_stats['dropped_oldest']}, "
+                  f"склеено {reader_stats['coalesced']}, "
+                  f"блоков во время сигнала: пропущено {reader_stats['skipped_playback']}, "
+                  f"приглушено {reader_stats['attenuated_playback']}")
+    if alert_player.mixer is not None and alert_player.mixer.last_start_latency_ms is not None:
+        logging.debug(f"Задержка старта звукового сигнала: {alert_player.mixer.last_start_latency_ms:.1f} мс")
+    if VAD_ENABLED:
+        vad_stats = vad_gate.stats()
+        logging.debug(f"Детектор речи: пропущено {vad_stats['skipped_share']:.1%} аудио без распознавания")
+    return stats['overruns']
 
 # Verify Vosk model path
 model_path = "/home/alex/learn/voise_py/model"
@@ -37,53 +377,167 @@ if not os.path.exists(model_path):
     sys.exit(1)
 
 model = Model(model_path)
-rec = KaldiRecognizer(model, 16000)
+rec = KaldiRecognizer(model, SAMPLE_RATE)  # Полный словарь, только в окне команды
 
 activation_detected = False  # Flag to prevent multiple activations
 
-pops_sound = "/home/alex/homeAI/voise_py/sounds/pops.mp3"
+sounds_directory = "/home/alex/homeAI/voise_py/sounds"
+pops_sound = os.path.join(sounds_directory, "pops.mp3")
+pops_wav_sound = os.path.join(sounds_directory, "pops.wav")
+SOUND_CACHE_SIZE = 16  # Сколько декодированных звуков держать в памяти
+
+def resample(data, source_rate, target_rate):
+    # Линейная интерполяция по каждому каналу, data имеет форму (кадры, каналы)
+    frames = max(1, int(round(len(data) * target_rate / source_rate)))
+    source_positions = np.arange(len(data))
+    target_positions = np.linspace(0, len(data) - 1, frames)
+    channels = [np.interp(target_positions, source_positions, data[:, channel])
+                for channel in range(data.shape[1])]
+    return np.stack(channels, axis=1)
+
+class SoundCache:
+    # Звуки, декодированные в PCM и приведённые к частоте и числу каналов устройства вывода.
+    # Редко используемые звуки вытесняются (LRU).
+    def __init__(self, samplerate, channels, max_items=SOUND_CACHE_SIZE):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def preload(self, directory):
+        for name in sorted(os.listdir(directory)):
+            file_path = os.path.join(directory, name)
+            if not os.path.isfile(file_path):
+                continue
+            try:
+                self.get(file_path)
+            except Exception as e:
+                logging.error(f"Не удалось загрузить звук {file_path}: {e}")
+        logging.info(f"Загружено звуков в кэш: {len(self._items)}")
+
+    def get(self, file_path):
+        key = os.path.abspath(file_path)
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                return data
+        data = self._load(key)
+        with self._lock:
+            self._items[key] = data
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return data
+
+    def _load(self, file_path):
+        data, sample_rate = sf.read(file_path, dtype='float32', always_2d=True)
+        if sample_rate != self.samplerate:
+            data = resample(data, sample_rate, self.samplerate)
+        if data.shape[1] != self.channels:
+            data = np.repeat(data.mean(axis=1, keepdims=True), self.channels, axis=1)
+        return np.ascontiguousarray(data, dtype=np.float32)
+
+class OutputMixer:
+    # Один долгоживущий OutputStream: звуки микшируются в его callback,
+    # поэтому устройство не открывается заново для каждого сигнала.
+    def __init__(self, samplerate, channels):
+        self.samplerate = samplerate
+        self.channels = channels
+        self._voices = []  # [данные, позиция, время постановки]
+        self._lock = threading.Lock()
+        self._stream = None
+        self.playing = threading.Event()
+        self.last_start_latency_ms = None  # От play() до первого кадра, отданного устройству
+
+    def start(self):
+        if self._stream is None:
+            self._stream = sd.OutputStream(samplerate=self.samplerate, channels=self.channels,
+                                           dtype='float32', latency='low', callback=self._callback)
+            self._stream.start()
+
+    def play(self, data):
+        with self._lock:
+            self._voices.append([data, 0, time.perf_counter()])
+            self.playing.set()
+
+    def _callback(self, outdata, frames, time_info, status):
+        outdata.fill(0)
+        with self._lock:
+            if not self._voices:
+                return
+            for voice in self._voices:
+                data, position, queued_at = voice
+                if position == 0:
+                    self.last_start_latency_ms = (time.perf_counter() - queued_at) * 1000
+                chunk = data[position:position + frames]
+                outdata[:len(chunk)] += chunk
+                voice[1] = position + len(chunk)
+            self._voices = [voice for voice in self._voices if voice[1] < len(voice[0])]
+            if not self._voices:
+                self.playing.clear()
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+class AlertPlayer:
+    # Воспроизводит звуковые сигналы из кэша через OutputMixer. play() не ждёт
+    # окончания сигнала, промахи кэша декодируются в отдельном потоке.
+    # Пока сигнал звучит, установлен playing.
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = None
+        self.cache = None
+        self.mixer = None
+        self.playing = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        try:
+            device = sd.query_devices(kind='output')
+            samplerate = int(device['default_samplerate'])
+            channels = min(2, device['max_output_channels'])
+            self.cache = SoundCache(samplerate, channels)
+            self.cache.preload(sounds_directory)
+            self.mixer = OutputMixer(samplerate, channels)
+            self.mixer.start()
+            self.playing = self.mixer.playing
+        except Exception as e:
+            logging.error(f"Ошибка при инициализации вывода звука: {e}")
+        self._thread = threading.Thread(target=self._run, name="alert-player", daemon=True)
+        self._thread.start()
+
+    def play(self, file_path):
+        # Не блокирует: если сигнал уже в очереди, новый пропускается
+        try:
+            self._queue.put_nowait(file_path)
+            return True
+        except queue.Full:
+            logging.debug("Звуковой сигнал уже воспроизводится, пропускаем")
+            return False
+
+    def _run(self):
+        while True:
+            file_path = self._queue.get()
+            try:
+                if self.mixer is None:
+                    raise RuntimeError("устройство вывода не инициализировано")
+                self.mixer.play(self.cache.get(file_path))
+                logging.info("Звуковой сигнал запущен")
+            except Exception as e:
+                logging.error(f"Ошибка при воспроизведении звука: {e}")
+
+
+alert_player = AlertPlayer()
 
 def play_alert_sound(file_path=pops_sound):
-    try:
-        # Чтение аудиофайла
-        data, sample_rate = sf.read(file_path)  # Используем file_path, переданный в функцию
-        # Воспроизведение аудиофайла через sounddevice
-        sd.play(data, samplerate=sample_rate)
-        sd.wait()  # Ожидание завершения воспроизведения
-        logging.info("Звуковой сигнал воспроизведён")
-    except Exception as e:
-        logging.error(f"Ошибка при воспроизведении звука: {e}")
-
-# Dictionary of programs and commands with synonyms
-programs = {
-    ('браузер', 'брауер', 'chrome'): {
-        'start': ('Google Chrome', '/usr/bin/google-chrome'),
-        'stop': 'chrome'
-    },
-    ('музыка', 'музыку', 'yandex'): {
-        'start': ('Музыка', None), 
-        'stop': 'music'
-    },
-    ('редактор', 'саблайм', 'sublime', 'текстовый'): {
-        'start': ('Текстовый редактор', '/usr/bin/subl'),
-        'stop': 'subl'
-    },
-    ('терминал', 'консоль', 'terminator'): {
-        'start': ('Терминал', '/usr/bin/terminator'),
-        'stop': 'terminator'
-    },
-    ('стим', 'steam'): {
-        'start': ('Steam', '/usr/bin/steam'),
-        'stop': 'steam'
-    },
-    ('дота', 'доту', 'dota', 'дотан', 'дотанчик', 'дотку', 'дотка'): {
-        'start': ('Dota2', 'steam steam://rungameid/570'),
-        'stop': 'dota2'
-    },
-    ('ноут', 'ноутбук', 'комп', 'компьютер', 'shutdown', 'poweroff'): {
-        'stop': 'poweroff'
-    }
-}
+    started = time.perf_counter()
+    if alert_player.play(file_path):
+        logging.debug(f"Звуковой сигнал поставлен в очередь за {(time.perf_counter() - started) * 1000:.3f} мс")
 
 # Activation words and compiled patterns
 activation_words = ["лили", "лилли", "лелли", "лилие", "лилия", "лиля", "лия", "лилль"]
@@ -94,42 +548,263 @@ activation_removal_pattern = re.compile(
     r"\b(" + "|".join([re.escape(word) for word in activation_words]) + r")\b|^или\b"
 )
 
+# В режиме ожидания распознаём только слова активации: грамматика из нескольких слов
+# декодируется намного дешевле полного словаря. Требует модель с поддержкой грамматик
+# (vosk-model-small-*). "или" — частое искажение "лили", см. activation_pattern.
+wake_grammar = json.dumps(activation_words + ["или", "[unk]"], ensure_ascii=False)
+wake_rec = KaldiRecognizer(model, SAMPLE_RATE, wake_grammar)
+COMMAND_WINDOW_S = 8  # Сколько ждать команду после слова активации
+COMMAND_GRAMMAR_ENABLED = True  # False — окно команды распознаётся полным словарём
+
+
+executor_url = 'http://localhost:5000/execute'  # URL вашего Flask-сервера
+HTTP_CONNECT_TIMEOUT_S = 0.5
+HTTP_READ_TIMEOUT_S = 2.0
+HTTP_RETRIES = 2  # Повторяются только ошибки соединения: запрос ещё не дошёл до сервера
 
-start_pattern = re.compile(r"(включ[иы]|запуст[иы]|откр[оа]й|покаж[иы]|откр[юу]|открыть|включить)")
-stop_pattern = re.compile(r"(выключ[иы]|закрыть|закр[оа]й|останов[иы]|прекрат[иы]|выключить)")
-music_play_pattern = re.compile(r"(включ[иыть] музы[ку]|нач[ао]ть воспроизвед[её]ние)")
-music_pause_pattern = re.compile(r"(пауз[ау]|продолж(и|ил|ить|ать|им|ишь|ит|им|ите|ат))")
-music_next_pattern = re.compile(r"(следующ(ий|ие|ее|ей))")
-music_volume_pattern = re.compile(r"громкость\s*(\d+)")
+def create_http_session():
+    # Одна сессия с пулом keep-alive соединений на всё время работы
+    session = requests.Session()
+    retries = Retry(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=0, status=0, other=0,
+                    backoff_factor=0.05, allowed_methods=None)
+    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retries))
+    return session
 
+http_session = create_http_session()
 
+USE_UNIX_SOCKET = True  # Сначала Unix-сокет CommandExecutor, HTTP — если сокет недоступен
+socket_client = ipc.CommandSocketClient(timeout=HTTP_READ_TIMEOUT_S)
 
 def send_command(command_type, command_name, parameters):
-    url = 'http://localhost:5000/execute'  # URL вашего Flask-сервера
+    # Возвращает (успех, ответ сервера или текст ошибки)
+    if USE_UNIX_SOCKET and command_type in ipc.command_type_codes:
+        started = time.perf_counter()
+        try:
+            ok, message = socket_client.request(command_type, command_name, parameters)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if ok:
+                logging.info(f"Команда отправлена через сокет за {elapsed_ms:.2f} мс: {message}")
+            else:
+                logging.error(f"Ошибка при отправке команды через сокет ({elapsed_ms:.2f} мс): {message}")
+            return ok, message
+        except ipc.TransportUnavailable as e:
+            logging.debug(f"Unix-сокет недоступен ({e}), отправка по HTTP")
+        except Exception as e:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            logging.error(f"Ошибка при отправке команды через сокет ({elapsed_ms:.2f} мс): {e}")
+            return False, str(e)
+
     payload = {
         'command_type': command_type,
         'command_name': command_name,
         'parameters': parameters
     }
+    started = time.perf_counter()
     try:
-        response = requests.post(url, json=payload)
+        response = http_session.post(executor_url, json=payload,
+                                     timeout=(HTTP_CONNECT_TIMEOUT_S, HTTP_READ_TIMEOUT_S))
+        elapsed_ms = (time.perf_counter() - started) * 1000
         if response.status_code == 200:
-            logging.info(f"Команда отправлена успешно: {response.json()}")
-        else:
-            logging.error(f"Ошибка при отправке команды: {response.status_code} {response.text}")
+            logging.info(f"Команда отправлена успешно за {elapsed_ms:.1f} мс: {response.json()}")
+            return True, response.json()
+        logging.error(f"Ошибка при отправке команды ({elapsed_ms:.1f} мс): {response.status_code} {response.text}")
+        return False, f"{response.status_code} {response.text}"
     except Exception as e:
-        logging.error(f"Ошибка при отправке команды: {e}")
-
-number_words_to_digits = {
-    'ноль': 0, 'один': 1, 'два': 2, 'три': 3, 'четыре': 4, 
-    'пять': 5, 'шесть': 6, 'семь': 7, 'восемь': 8, 'девять': 9, 'десять': 10
-}
-
-def replace_number_words_with_digits(text):
-    for word, digit in number_words_to_digits.items():
-        text = re.sub(rf"\b{word}\b", str(digit), text)
-    return text
-
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logging.error(f"Ошибка при отправке команды ({elapsed_ms:.1f} мс): {e}")
+        return False, str(e)
+
+DISPATCH_QUEUE_SIZE = 8
+
+# Результат доставки команды CommandExecutor. stage: 'ack' — команда принята,
+# 'done' — выполнена (только через WebSocket); elapsed_ms отсчитывается от отправки
+DeliveryEvent = namedtuple('DeliveryEvent', ['intent', 'stage', 'ok', 'detail', 'queued_ms', 'elapsed_ms'])
+
+class CommandDispatcher:
+    # Отправляет команды в отдельном потоке: recognize_loop только ставит намерение
+    # в очередь и не ждёт сеть. Результаты доставки возвращаются через events.
+    def __init__(self, queue_size=DISPATCH_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self.events = queue.Queue()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="command-dispatcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, intent):
+        try:
+            self._queue.put_nowait((intent, time.perf_counter()))
+            return True
+        except queue.Full:
+            logging.error(f"Очередь команд переполнена, команда отброшена: {intent}")
+            self.events.put(DeliveryEvent(intent, 'ack', False, "очередь команд переполнена", 0.0, 0.0))
+            return False
+
+    def _run(self):
+        while True:
+            intent, submitted_at = self._queue.get()
+            started = time.perf_counter()
+            queued_ms = (started - submitted_at) * 1000
+            # Через WebSocket подтверждение и результат придут событиями от command_channel
+            if USE_WEBSOCKET and command_channel.send(intent, queued_ms):
+                continue
+            ok, detail = send_command(intent.command_type, intent.command_name, intent.parameters)
+            self.events.put(DeliveryEvent(intent, 'ack', ok, detail, queued_ms,
+                                          (time.perf_counter() - started) * 1000))
+
+    def poll_events(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+command_dispatcher = CommandDispatcher()
+
+USE_WEBSOCKET = True  # Основной канал; если он недоступен — Unix-сокет или HTTP
+websocket_url = 'ws://localhost:5001'
+WEBSOCKET_RECONNECT_S = 5  # Не чаще одной попытки подключения за этот интервал
+
+class CommandChannel:
+    # Долгоживущее WebSocket-соединение с CommandExecutor. Команды отправляются без
+    # ожидания ответа, подтверждения (ack) и результаты (done) читает отдельный поток
+    # и превращает в DeliveryEvent с задержкой от момента отправки.
+    def __init__(self, url, events):
+        self.url = url
+        self.events = events
+        self._connection = None
+        self._pending = {}  # id -> (намерение, время в очереди, время отправки, соединение)
+        self._next_id = 0
+        self._last_attempt = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        now = time.monotonic()
+        if now - self._last_attempt < WEBSOCKET_RECONNECT_S:
+            return False
+        self._last_attempt = now
+        try:
+            connection = connect_websocket(self.url, open_timeout=HTTP_CONNECT_TIMEOUT_S)
+        except Exception as e:
+            logging.debug(f"WebSocket недоступен ({e})")
+            return False
+        self._connection = connection
+        threading.Thread(target=self._receive, args=(connection,), name="command-channel", daemon=True).start()
+        logging.info(f"Подключён канал команд {self.url}")
+        return True
+
+    def send(self, intent, queued_ms):
+        # False — команда не отправлена, её нужно доставить другим транспортом
+        with self._lock:
+            if self._connection is None and not self._connect():
+                return False
+            self._next_id += 1
+            command_id = self._next_id
+            connection = self._connection
+            self._pending[command_id] = (intent, queued_ms, time.perf_counter(), connection)
+            try:
+                connection.send(json.dumps({
+                    'id': command_id,
+                    'command_type': intent.command_type,
+                    'command_name': intent.command_name,
+                    'parameters': intent.parameters,
+                }, ensure_ascii=False))
+                return True
+            except Exception as e:
+                logging.warning(f"Ошибка отправки через WebSocket: {e}")
+                del self._pending[command_id]
+                self._connection = None
+                connection.close()
+                return False
+
+    def _receive(self, connection):
+        try:
+            for raw_message in connection:
+                self._handle_event(json.loads(raw_message))
+        except Exception as e:
+            logging.warning(f"Канал команд закрыт: {e}")
+        finally:
+            with self._lock:
+                if self._connection is connection:
+                    self._connection = None
+                lost = [command_id for command_id, entry in self._pending.items() if entry[3] is connection]
+                lost_entries = [self._pending.pop(command_id) for command_id in lost]
+            for intent, queued_ms, sent_at, entry_connection in lost_entries:
+                self.events.put(DeliveryEvent(intent, 'done', False, "соединение с CommandExecutor потеряно",
+                                              queued_ms, (time.perf_counter() - sent_at) * 1000))
+
+    def _handle_event(self, event):
+        kind = event.get('event')
+        finished = kind in ('done', 'error')
+        with self._lock:
+            entry = self._pending.pop(event.get('id'), None) if finished else self._pending.get(event.get('id'))
+        if entry is None:
+            return
+        intent, queued_ms, sent_at, connection = entry
+        ok = kind == 'ack' or (kind == 'done' and bool(event.get('ok')))
+        self.events.put(DeliveryEvent(intent, 'done' if finished else 'ack', ok, event.get('message'),
+                                      queued_ms, (time.perf_counter() - sent_at) * 1000))
+
+command_channel = CommandChannel(websocket_url, command_dispatcher.events)
+
+def handle_delivery_events():
+    for event in command_dispatcher.poll_events():
+        command = f"{event.intent.command_type}/{event.intent.command_name}"
+        if not event.ok:
+            logging.warning(f"Команда {command} не выполнена: {event.detail}")
+        elif event.stage == 'done':
+            logging.info(f"Команда {command} выполнена за {event.elapsed_ms:.1f} мс "
+                         f"(в очереди {event.queued_ms:.1f} мс): {event.detail}")
+        else:
+            logging.debug(f"Команда {command} принята за {event.elapsed_ms:.1f} мс "
+                          f"(в очереди {event.queued_ms:.1f} мс)")
+
+intent_matcher = IntentMatcher(programs)
+
+def build_command_grammar():
+    phrases = []
+    index = intent_matcher.index
+    for verbs, action in ((start_verbs, 'start'), (stop_verbs, 'stop')):
+        for (program_keywords, program_info), keywords in zip(index.programs, index.keywords):
+            if action not in program_info:
+                continue
+            for keyword in keywords:
+                phrases.extend(f"{verb} {keyword}" for verb in verbs)
+    phrases.extend(music_phrases)
+    phrases.extend(f"{volume_word} {word}" for word in number_words_to_digits)
+    # Блок со словом активации тоже попадает в окно команды
+    phrases.extend(activation_words)
+    phrases.append("[unk]")
+    return json.dumps(list(dict.fromkeys(phrases)), ensure_ascii=False)
+
+# Таблицы программ меняются только при загрузке алиасов, поэтому грамматика собирается
+# при запуске и пересобирается в load_program_aliases, а не при каждой активации
+command_grammar = build_command_grammar()
+installed_command_grammar = None
+
+def load_program_aliases(file_path):
+    global command_grammar
+    added = intent_matcher.index.load_aliases(file_path)
+    command_grammar = build_command_grammar()
+    return added
+
+# Пользовательские синонимы программ ("алиас = известный синоним")
+aliases_file = "/home/alex/homeAI/voise_py/aliases.txt"
+if os.path.exists(aliases_file):
+    logging.info(f"Загружено алиасов программ: {load_program_aliases(aliases_file)}")
+
+def install_command_grammar():
+    # Ставит собранную грамматику на rec, если она ещё не установлена. Vosk не меняет
+    # грамматику распознавателя посреди фразы, поэтому вызывается только после rec.Reset()
+    global installed_command_grammar
+    if not COMMAND_GRAMMAR_ENABLED or command_grammar is installed_command_grammar:
+        return
+    rec.SetGrammar(command_grammar)
+    installed_command_grammar = command_grammar
+    logging.info(f"Грамматика команд установлена: {len(json.loads(command_grammar))} фраз")
 
 def process_command(text):
     global activation_detected
@@ -142,104 +817,60 @@ def process_command(text):
         logging.warning("Команда пуста после удаления слов активации.")
         activation_detected = False  # Сбрасываем флаг активации
         return
-    text = replace_number_words_with_digits(text)
-
-    # Проверка команды громкости
-    volume_match = music_volume_pattern.search(text)
-    if volume_match:
-        volume_level = int(volume_match.group(1))
-        send_command('music', 'setVolume', {'level': volume_level})
-        activation_detected = False
-        return
 
-    # **Проверяем музыкальные команды перед программными**
-    if music_play_pattern.search(text):
-        send_command('music', 'play', {})
-        activation_detected = False
-        return
-    elif music_pause_pattern.search(text):
-        send_command('music', 'togglePause', {})
-        activation_detected = False
-        return
-    elif music_next_pattern.search(text):
-        send_command('music', 'next', {})
-        activation_detected = False
+    intent = intent_matcher.match(text)
+    if intent is None:
+        logging.warning(f"Неизвестная команда: {text}")
         return
+    command_dispatcher.submit(intent)
+    activation_detected = False
 
-    # Теперь обрабатываем программные команды
-    for program_keywords, program_info in programs.items():
-        program_pattern = r"\b(" + "|".join([re.escape(keyword) for keyword in program_keywords]) + r")\b"
-
-        # Проверка команды запуска
-        if start_pattern.search(text) and re.search(program_pattern, text):
-            if 'start' in program_info:
-                command_type = 'start'
-                program_name, program_path = program_info['start']
-                parameters = {}
-                send_command(command_type, program_name, parameters)
-                activation_detected = False
-            return
-
-        # Проверка команды остановки
-        if stop_pattern.search(text) and re.search(program_pattern, text):
-            if 'stop' in program_info:
-                command_type = 'stop'
-                command_name = program_info['stop']
-                parameters = {}
-                send_command(command_type, command_name, parameters)
-                activation_detected = False
-            return
-
-
-    logging.warning(f"Неизвестная команда: {text}")
-    # Существующая обработка программ
-    for program_keywords, program_info in programs.items():
-        program_pattern = r"\b(" + "|".join([re.escape(keyword) for keyword in program_keywords]) + r")\b"
-
-        # Check for start command
-        if start_pattern.search(text) and re.search(program_pattern, text):
-            if 'start' in program_info:
-                command_type = 'start'
-                program_name, program_path = program_info['start']
-                parameters = {}
-                # For browser commands, check if there is a URL in text
-                if program_name == 'Google Chrome':
-                    # Extract URL from text if possible
-                    url_match = re.search(r'\b(https?://[^\s]+)', text)
-                    if url_match:
-                        parameters['url'] = url_match.group(0)
-                send_command(command_type, program_name, parameters)
-                activation_detected = False
-            return
-
-        # Check for stop command
-        if stop_pattern.search(text) and re.search(program_pattern, text):
-            if 'stop' in program_info:
-                command_type = 'stop'
-                command_name = program_info['stop']
-                parameters = {}
-                send_command(command_type, command_name, parameters)
-                activation_detected = False
-            return
+def handle_result(result):
+    try:
+        result_json = json.loads(result)
+        text = result_json.get("text", "").lower()
+        logging.debug(f"Распознанный текст: {text}")
 
-    logging.warning(f"Неизвестная команда: {text}")
+        process_text(text)
+    except json.JSONDecodeError as e:
+        logging.error(f"Ошибка декодирования JSON результата: {e}")
 
 def recognize_loop():
     global activation_detected
+    blocks = 0
+    last_overruns = 0
+    active_rec = wake_rec
+    command_window_started = 0
     while True:
-        data = q.get()
-        if rec.AcceptWaveform(data):
-            result = rec.Result()
-            try:
-                result_json = json.loads(result)
-                text = result_json.get("text", "").lower()
-                logging.debug(f"Распознанный текст: {text}")
-
-                process_text(text)
-            except json.JSONDecodeError as e:
-                logging.error(f"Ошибка декодирования JSON результата: {e}")
-        else:
-            partial_result = rec.PartialResult()
+        data = audio_reader.read()
+        handle_delivery_events()
+        blocks += 1
+        if blocks % STATS_INTERVAL == 0:
+            last_overruns = log_buffer_stats(last_overruns)
+
+        chunks = vad_gate.process(data) if VAD_ENABLED else [data]
+        if not chunks:
+            # Тишина: распознаватель не вызываем, но окно команды продолжает истекать
+            if activation_detected and time.monotonic() - command_window_started > COMMAND_WINDOW_S:
+                logging.info("Команда не получена, возврат в режим ожидания")
+                activation_detected = False
+            continue
+
+        for chunk in chunks:
+            # Переключаемся между грамматикой активации и полным распознавателем
+            expected_rec = rec if activation_detected else wake_rec
+            if expected_rec is not active_rec:
+                expected_rec.Reset()
+                if expected_rec is rec:
+                    install_command_grammar()
+                active_rec = expected_rec
+                command_window_started = time.monotonic()
+
+            if active_rec.AcceptWaveform(chunk):
+                handle_result(active_rec.Result())
+                continue
+
+            partial_result = active_rec.PartialResult()
             try:
                 partial_json = json.loads(partial_result)
                 partial_text = partial_json.get("partial", "").lower()
@@ -252,6 +883,17 @@ def recognize_loop():
                     logging.info(f"Слово активации распознано (промежуточно): '{partial_text}'. Ожидание команды...")
                     play_alert_sound()
                     activation_detected = True
+                    rec.Reset()
+                    install_command_grammar()
+                    active_rec = rec
+                    command_window_started = time.monotonic()
+                    # Блок со словом активации может содержать и начало команды
+                    if rec.AcceptWaveform(chunk):
+                        handle_result(rec.Result())
+                elif (activation_detected and not partial_text.strip()
+                      and time.monotonic() - command_window_started > COMMAND_WINDOW_S):
+                    logging.info("Команда не получена, возврат в режим ожидания")
+                    activation_detected = False
             except json.JSONDecodeError as e:
                 logging.error(f"Ошибка декодирования JSON промежуточного результата: {e}")
 
@@ -261,7 +903,7 @@ def process_text(text):
     if not activation_detected:
         if activation_pattern.search(text):
             logging.info(f"Слово активации распознано: '{text}'. Ожидание команды...")
-            play_alert_sound("/home/alex/homeAI/voise_py/sounds/pops.wav")
+            play_alert_sound(pops_wav_sound)
             activation_detected = True
     else:
         # Remove activation words from the command text to prevent re-activation
@@ -276,14 +918,20 @@ def process_text(text):
 
 def main():
     try:
-        with sd.RawInputStream(samplerate=16000, blocksize=4000, dtype='int16',
+        alert_player.start()
+        command_dispatcher.start()
+        with sd.RawInputStream(samplerate=SAMPLE_RATE, blocksize=BLOCK_FRAMES, dtype='int16',
                                channels=1, callback=callback):
+            install_command_grammar()
             logging.info("Начато прослушивание...")
             recognize_loop()
     except KeyboardInterrupt:
         logging.info("Прерывание пользователем. Завершение работы.")
     except Exception as e:
         logging.error(f"Неизвестная ошибка: {e}")
+    finally:
+        if alert_player.mixer is not None:
+            alert_player.mixer.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file